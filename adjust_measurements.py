@@ -1,29 +1,13 @@
 import datetime
-from typing import List
+from typing import List, Tuple
+import numpy as np
 import pandas as pd
 import sys
+from mcperf_parser import McperfFile
 from scheduler_logger import SchedulerLogger, Job
 
-utilization = pd.read_csv(f'{sys.argv[1]}/utilization.csv')
-jobs = pd.read_csv(f'{sys.argv[1]}/jobs.csv', names=['job', 'start_time', 'end_time'], header=None)
-logger = SchedulerLogger(int(sys.argv[2]), str(utilization['time'][0]))
 time_format = '%Y-%m-%dT%H:%M:%S.%f'
-
-mcperf_start = datetime.datetime.now()
-mcperf_end = datetime.datetime.now()
-with open(f'{sys.argv[1]}/mcperf.txt', 'r', encoding='utf-8') as mcperf_file:
-    for line in mcperf_file:
-        if line.startswith('Timestamp start: '):
-            mcperf_start = datetime.datetime.fromtimestamp(int(line.replace('Timestamp start: ', '')) / 1000)
-        if line.startswith('Timestamp end: '):
-            mcperf_end = datetime.datetime.fromtimestamp(int(line.replace('Timestamp end: ', '')) / 1000)
-logger.job_start(mcperf_start.strftime(time_format), Job.MEMCACHED, ['0', '1'], 2)
-
-def parse_date_string(date_string: str) -> datetime.datetime:
-    return datetime.datetime.strptime(date_string, time_format)
-
-def get_unix_timestamp(date: datetime.datetime) -> int:
-    return int(date.timestamp() * 1000)
+NUM_CPUS = 4
 
 def get_threads_for_job(job: str) -> int:
     if job == 'radix' or job == 'dedup': return 1
@@ -36,43 +20,82 @@ def get_init_cpuset_for_job(job: str) -> List[str]:
     if job == 'vips': return ['3']
     return ['2', '3']
 
-def get_cores_for_job(job: str, event) -> List[int]:
-    cores = []
-    if job in str(event.jobs0): cores.append(0)
-    if job in str(event.jobs1): cores.append(1)
-    if job in str(event.jobs2): cores.append(2)
-    if job in str(event.jobs3): cores.append(3)
-    return cores
+def to_milliseconds(times: pd.Series) -> np.ndarray:
+    # Both files hold naive timestamps, so comparing them without a time
+    # zone gives the same order as comparing their local Unix timestamps
+    return pd.to_datetime(times, format=time_format).to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+def find_rows(times: np.ndarray, instants: np.ndarray) -> np.ndarray:
+    # The utilization row i at which an instant falls strictly between the
+    # previous row (or 0 for the first one) and row i; len(times) if none
+    rows = np.searchsorted(times, instants, side='right')
+    on_previous_row = (rows > 0) & (rows < len(times)) & (times[np.maximum(rows - 1, 0)] == instants)
+    rows[on_previous_row] = len(times)
+    return rows
+
+def core_masks(utilization: pd.DataFrame, job: str) -> np.ndarray:
+    masks = np.zeros(len(utilization), dtype=np.int64)
+    for cpu in range(NUM_CPUS):
+        column = utilization[f'jobs{cpu}'].astype(str)
+        masks |= column.str.contains(job, regex=False).to_numpy().astype(np.int64) << cpu
+    return masks
+
+def mask_cores(mask: int) -> List[str]:
+    return [str(cpu) for cpu in range(NUM_CPUS) if mask & (1 << cpu)]
+
+def core_changes(masks: np.ndarray, start_row: int, end_row: int, initial: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # From the row a job started on, every row whose cores differ from the
+    # last logged ones is a change, except on the row the job ended on
+    rows = np.arange(start_row, len(masks))
+    rows = rows[rows != end_row]
+    sequence = np.concatenate(([initial], masks[rows]))
+    changed = np.flatnonzero(sequence[1:] != sequence[:-1])
+    return rows[changed], sequence[changed], sequence[changed + 1]
+
+if __name__ == '__main__':
+    utilization = pd.read_csv(f'{sys.argv[1]}/utilization.csv')
+    jobs = pd.read_csv(f'{sys.argv[1]}/jobs.csv', names=['job', 'start_time', 'end_time'], header=None)
+    logger = SchedulerLogger(int(sys.argv[2]), str(utilization['time'][0]))
+
+    mcperf_start = datetime.datetime.now()
+    mcperf_end = datetime.datetime.now()
+    mcperf = McperfFile(f'{sys.argv[1]}/mcperf.txt')
+    mcperf.count()
+    if mcperf.timestamp_start is not None:
+        mcperf_start = datetime.datetime.fromtimestamp(mcperf.timestamp_start / 1000)
+    if mcperf.timestamp_end is not None:
+        mcperf_end = datetime.datetime.fromtimestamp(mcperf.timestamp_end / 1000)
+    logger.job_start(mcperf_start.strftime(time_format), Job.MEMCACHED, ['0', '1'], 2)
 
-JOBS = {}
+    # Every timestamp is parsed once; events are placed on utilization rows
+    # by binary search and core changes come from diffs over those rows
+    times = to_milliseconds(utilization['time'])
+    start_rows = find_rows(times, to_milliseconds(jobs['start_time']))
+    end_rows = find_rows(times, to_milliseconds(jobs['end_time']))
+    row_times = utilization['time'].astype(str).to_numpy()
 
-prev_time = 0
-for _, event in utilization.iterrows():
-    curr_time = get_unix_timestamp(parse_date_string(event.time))
-    for _, job in jobs.iterrows():
+    # (row, position in jobs.csv, start/change/end, method, arguments)
+    events = []
+    for position, job in enumerate(jobs.itertuples(index=False)):
+        start_row = int(start_rows[position])
+        end_row = int(end_rows[position])
         job_type = Job(job.job)
-        start_time = parse_date_string(job.start_time)
-        end_time = parse_date_string(job.end_time)
-        job_started = prev_time < get_unix_timestamp(start_time) < curr_time
-        job_ended = prev_time < get_unix_timestamp(end_time) < curr_time
-        if job_started:
-            logger.job_start(job.start_time, job_type, get_init_cpuset_for_job(job.job), get_threads_for_job(job.job))
-            JOBS[job.job] = {
-                'cores': [int(core) for core in get_init_cpuset_for_job(job.job)]
-            }
-        if job.job in JOBS:
-            curr_cores = get_cores_for_job(job.job, event)
-            if JOBS[job.job]['cores'] != curr_cores and not job_ended:
-                if len(curr_cores) == 0:
-                    logger.job_pause(event.time, job_type)
-                elif len(JOBS[job.job]['cores']) == 0:
-                    logger.job_unpause(event.time, job_type)
+        if start_row < len(times):
+            events.append((start_row, position, 0, logger.job_start,
+                (job.start_time, job_type, get_init_cpuset_for_job(job.job), get_threads_for_job(job.job))))
+            initial = sum([1 << int(core) for core in get_init_cpuset_for_job(job.job)])
+            for row, old, new in zip(*core_changes(core_masks(utilization, job.job), start_row, end_row, initial)):
+                if new == 0:
+                    events.append((int(row), position, 1, logger.job_pause, (row_times[row], job_type)))
+                elif old == 0:
+                    events.append((int(row), position, 1, logger.job_unpause, (row_times[row], job_type)))
                 else:
-                    logger.update_cores(event.time, job_type, [str(core) for core in curr_cores])
-                JOBS[job.job]['cores'] = curr_cores
-        if job_ended:
-            logger.job_end(job.end_time, job_type)
-    prev_time = curr_time
+                    events.append((int(row), position, 1, logger.update_cores, (row_times[row], job_type, mask_cores(new))))
+        if end_row < len(times):
+            events.append((end_row, position, 2, logger.job_end, (job.end_time, job_type)))
+    events.sort(key=lambda event: event[:3])
+    for _, _, _, log, arguments in events:
+        log(*arguments)
 
-logger.job_end(mcperf_end.strftime(time_format), Job.MEMCACHED)
-logger.end(str(utilization['time'][len(utilization) - 1]))
+    logger.job_end(mcperf_end.strftime(time_format), Job.MEMCACHED)
+    logger.end(str(utilization['time'][len(utilization) - 1]))
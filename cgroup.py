@@ -0,0 +1,50 @@
+import os
+from typing import List, Optional
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+def is_cgroup_v2() -> bool:
+    return os.path.exists(os.path.join(CGROUP_ROOT, 'cgroup.controllers'))
+
+def find_container_cgroup(container_id: str, controller: str = 'cpu') -> Optional[str]:
+    # Docker places containers under docker/<id> with the cgroupfs driver and
+    # under system.slice/docker-<id>.scope with the systemd driver
+    if is_cgroup_v2():
+        roots = [CGROUP_ROOT]
+    else:
+        names = [controller, 'cpu,cpuacct', 'cpuacct'] if controller == 'cpu' else [controller]
+        roots = [os.path.join(CGROUP_ROOT, name) for name in names]
+    candidates: List[str] = []
+    for root in roots:
+        candidates.append(os.path.join(root, 'docker', container_id))
+        candidates.append(os.path.join(root, 'system.slice', f'docker-{container_id}.scope'))
+    for candidate in candidates:
+        if os.path.isdir(candidate):
+            return candidate
+    return None
+
+def cpu_usage_file(path: str) -> str:
+    if is_cgroup_v2():
+        return os.path.join(path, 'cpu.stat')
+    return os.path.join(path, 'cpuacct.usage')
+
+def parse_cpu_usage(data: bytearray) -> float:
+    # Returns the container's total CPU time in seconds from either
+    # cpu.stat (v2, "usage_usec N" on the first line) or cpuacct.usage (v1, ns)
+    if data.startswith(b'usage_usec'):
+        return int(data[11:data.index(b'\n')]) / 1e6
+    return int(data) / 1e9
+
+def write_cpu_limits(path: str, cpus: List[int], quota: int, period: int):
+    # cgroup v2 only, where cpuset and cpu share the container's directory.
+    # dockerd does the same writes for `docker update`, minus the HTTP
+    # round-trip and its own bookkeeping.
+    with open(os.path.join(path, 'cpuset.cpus'), 'w', encoding='ascii') as file:
+        file.write(','.join([str(cpu) for cpu in cpus]))
+    with open(os.path.join(path, 'cpu.max'), 'w', encoding='ascii') as file:
+        file.write(f'{quota} {period}')
+
+def freeze_cgroup(path: str, frozen: bool):
+    # cgroup v2 freezer, the same mechanism `docker pause` ends up using
+    with open(os.path.join(path, 'cgroup.freeze'), 'w', encoding='ascii') as file:
+        file.write('1' if frozen else '0')
@@ -0,0 +1,94 @@
+from typing import Dict, List, Optional, Tuple
+from job_profiles import PROFILES, JobProfile, speedup
+
+class JobEstimate:
+    def __init__(self, profile: JobProfile):
+        self.runtime = profile.runtime
+        self.parallel_fraction = profile.parallel_fraction
+        # Single-core seconds of work done so far
+        self.work_done = 0.0
+
+    def remaining(self) -> float:
+        # Never claim a job is done just because it outlived its profile
+        return max(self.runtime - self.work_done, 0.05 * self.runtime)
+
+    def finish_time(self, cores: float, threads: int) -> float:
+        rate = speedup(self.parallel_fraction, cores, threads)
+        return self.remaining() / rate if rate > 0 else float('inf')
+
+class CoreAllocator:
+    def __init__(self, profiles: Dict[str, JobProfile] = PROFILES, smoothing: float = 0.2):
+        self.profiles = profiles
+        self.smoothing = smoothing
+        self.estimates: Dict[str, JobEstimate] = {}
+
+    def estimate(self, name: str) -> JobEstimate:
+        if name not in self.estimates:
+            self.estimates[name] = JobEstimate(self.profiles.get(name, JobProfile(100.0, 0.5)))
+        return self.estimates[name]
+
+    def observe(self, name: str, allocated: float, used: float, elapsed: float, cpu_seconds: Optional[float] = None):
+        estimate = self.estimate(name)
+        if cpu_seconds is not None:
+            # CPU time from the cgroup, a good proxy for single-core work
+            estimate.work_done = cpu_seconds
+        else:
+            estimate.work_done += speedup(estimate.parallel_fraction, allocated, 1 << 10) * elapsed
+        if allocated <= 1.05 or used <= 0.1:
+            return
+        # With Amdahl's law the average number of busy cores equals the
+        # speedup, so the observed usage pins down the parallel fraction
+        used = min(used, allocated)
+        observed = max(0.0, min(1.0, (1 - 1 / used) / (1 - 1 / allocated))) if used > 1 else 0.0
+        if used >= 0.95 * allocated:
+            # Saturated, so the job may scale even better than observed
+            observed = max(observed, estimate.parallel_fraction)
+        estimate.parallel_fraction += self.smoothing * (observed - estimate.parallel_fraction)
+
+    def allocate(self, jobs: List[Tuple[str, int]], cpus: List[int], shared: Optional[Tuple[int, float]] = None,
+                 current: Optional[Dict[str, List[int]]] = None) -> Dict[str, Tuple[List[int], float]]:
+        # Returns {job: (cpuset, quota in cores)}, or {} when there are more
+        # jobs than whole cores and the caller should keep its own plan
+        if not jobs or len(jobs) > len(cpus):
+            return {}
+        threads = dict(jobs)
+        counts = {name: 1 for name, _ in jobs}
+        for _ in range(len(cpus) - len(jobs)):
+            name = self._next_job(counts, threads, 1.0)
+            if name is None:
+                break
+            counts[name] += 1
+        shared_job = self._next_job(counts, threads, shared[1]) if shared is not None and shared[1] > 0 else None
+
+        # Keep jobs on the cores they already have where possible
+        current = current or {}
+        free = list(cpus)
+        assigned: Dict[str, List[int]] = {}
+        for name in counts:
+            keep = [cpu for cpu in current.get(name, []) if cpu in free][:counts[name]]
+            assigned[name] = keep
+            for cpu in keep:
+                free.remove(cpu)
+        for name in counts:
+            while len(assigned[name]) < counts[name]:
+                assigned[name].append(free.pop(0))
+
+        allocation = {name: (sorted(cpuset), float(len(cpuset))) for name, cpuset in assigned.items()}
+        if shared_job is not None and shared is not None:
+            cpuset, quota = allocation[shared_job]
+            allocation[shared_job] = (sorted(cpuset + [shared[0]]), quota + shared[1])
+        return allocation
+
+    def _next_job(self, counts: Dict[str, float], threads: Dict[str, int], amount: float) -> Optional[str]:
+        # Minimise the makespan: help the job that would finish last, as long
+        # as the extra capacity actually speeds it up
+        best: Optional[str] = None
+        best_finish = -1.0
+        for name, cores in counts.items():
+            estimate = self.estimate(name)
+            finish = estimate.finish_time(cores, threads[name])
+            if finish - estimate.finish_time(cores + amount, threads[name]) <= 1e-6:
+                continue
+            if finish > best_finish:
+                best, best_finish = name, finish
+        return best
@@ -0,0 +1,122 @@
+import datetime
+import os
+from typing import List, Optional, Tuple
+import psutil
+from recorder import CsvSink
+
+def default_interface() -> Optional[str]:
+    with open('/proc/net/route', 'r', encoding='ascii') as file:
+        for line in file.readlines()[1:]:
+            fields = line.split()
+            if len(fields) > 1 and fields[1] == '00000000':
+                return fields[0]
+    return None
+
+def nic_irqs(interface: str) -> List[int]:
+    # Interrupt names either carry the interface name (e.g. ens4-TxRx-0) or
+    # the name of the device behind it (e.g. virtio1-input.0 on GCP)
+    names = [interface]
+    device = f'/sys/class/net/{interface}/device'
+    if os.path.exists(device):
+        names.append(os.path.basename(os.path.realpath(device)))
+    irqs = []
+    with open('/proc/interrupts', 'r', encoding='ascii') as file:
+        for line in file.readlines()[1:]:
+            irq, sep, rest = line.partition(':')
+            if not sep or not irq.strip().isdigit():
+                continue
+            action = rest.split()[-1] if rest.split() else ''
+            if any(action.startswith(name) for name in names) and 'config' not in action:
+                irqs.append(int(irq))
+    return irqs
+
+def queue_files(interface: str, prefix: str, name: str) -> List[str]:
+    directory = f'/sys/class/net/{interface}/queues'
+    if not os.path.isdir(directory):
+        return []
+    queues = sorted([queue for queue in os.listdir(directory) if queue.startswith(prefix)],
+                    key=lambda queue: int(queue[len(prefix):]))
+    return [os.path.join(directory, queue, name) for queue in queues]
+
+def cpu_mask(cpus: List[int]) -> str:
+    return format(sum([1 << cpu for cpu in cpus]), 'x')
+
+class NetworkAffinity:
+    def __init__(self, pid: int, interface: Optional[str] = None, irqs: bool = True,
+                 log: Optional[CsvSink] = None):
+        # Stands in for psutil.Process in Strategy.update_load_level: besides
+        # the process it moves every memcached thread and, optionally, the
+        # NIC's interrupts and RPS/XPS queues along with it
+        self.pid = pid
+        self.process = psutil.Process(pid)
+        self.interface = interface if interface is not None else default_interface()
+        self.irqs = nic_irqs(self.interface) if irqs and self.interface is not None else []
+        self.rps_files = queue_files(self.interface, 'rx-', 'rps_cpus') if irqs and self.interface is not None else []
+        self.xps_files = queue_files(self.interface, 'tx-', 'xps_cpus') if irqs and self.interface is not None else []
+        self.log = log
+        self.cpus: Optional[List[int]] = None
+
+    def threads(self) -> Tuple[List[int], List[int]]:
+        workers = []
+        others = []
+        for thread in self.process.threads():
+            try:
+                with open(f'/proc/{self.pid}/task/{thread.id}/comm', 'r', encoding='utf-8') as file:
+                    name = file.read().strip()
+            except OSError:
+                continue
+            if 'worker' in name:
+                workers.append(thread.id)
+            else:
+                others.append(thread.id)
+        return workers, others
+
+    def cpu_affinity(self, cpus: List[int]):
+        if cpus == self.cpus:
+            return
+        self.cpus = list(cpus)
+        errors = []
+        # psutil only moves the main thread, the worker threads keep
+        # whatever affinity they had when they were spawned
+        self.process.cpu_affinity(cpus)
+        workers, others = self.threads()
+        placement = []
+        for i, tid in enumerate(workers):
+            placement.append((tid, [cpus[i % len(cpus)]]))
+        for tid in others:
+            placement.append((tid, cpus))
+        for tid, thread_cpus in placement:
+            try:
+                os.sched_setaffinity(tid, thread_cpus)
+            except OSError as error:
+                errors.append(f'thread {tid}: {error.strerror}')
+        irqs = []
+        for i, irq in enumerate(self.irqs):
+            cpu = cpus[i % len(cpus)]
+            try:
+                with open(f'/proc/irq/{irq}/smp_affinity_list', 'w', encoding='ascii') as file:
+                    file.write(str(cpu))
+                irqs.append(f'{irq}:{cpu}')
+            except OSError as error:
+                # Managed interrupts cannot be moved from user space
+                errors.append(f'irq {irq}: {error.strerror}')
+        for path in self.rps_files:
+            self._write_mask(path, cpus, errors)
+        xps = []
+        for i, path in enumerate(self.xps_files):
+            queue_cpus = [cpu for j, cpu in enumerate(cpus) if j % len(self.xps_files) == i]
+            if self._write_mask(path, queue_cpus, errors):
+                xps.append(cpu_mask(queue_cpus))
+        if self.log is not None:
+            self.log.write([datetime.datetime.now().isoformat(), '|'.join([str(cpu) for cpu in cpus]),
+                '|'.join([f'{tid}:{cpus[i % len(cpus)]}' for i, tid in enumerate(workers)]),
+                '|'.join(irqs), cpu_mask(cpus) if self.rps_files else '', '|'.join(xps), '|'.join(errors)])
+
+    def _write_mask(self, path: str, cpus: List[int], errors: List[str]) -> bool:
+        try:
+            with open(path, 'w', encoding='ascii') as file:
+                file.write(cpu_mask(cpus))
+            return True
+        except OSError as error:
+            errors.append(f'{os.path.basename(os.path.dirname(path))}: {error.strerror}')
+            return False
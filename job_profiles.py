@@ -0,0 +1,30 @@
+from typing import Dict, NamedTuple
+
+class JobProfile(NamedTuple):
+    # Native-input runtime on a single core, in seconds
+    runtime: float
+    # Amdahl parallel fraction, i.e. how much of the runtime scales with cores
+    parallel_fraction: float
+
+# Rough priors for the project VMs; the online estimators refine them
+PROFILES: Dict[str, JobProfile] = {
+    'blackscholes': JobProfile(125.0, 0.80),
+    'canneal': JobProfile(250.0, 0.73),
+    'dedup': JobProfile(22.0, 0.44),
+    'ferret': JobProfile(320.0, 0.94),
+    'freqmine': JobProfile(490.0, 0.97),
+    'radix': JobProfile(60.0, 0.98),
+    'vips': JobProfile(125.0, 0.96),
+}
+
+def speedup(parallel_fraction: float, cores: float, threads: int) -> float:
+    cores = min(cores, threads)
+    if cores <= 0:
+        return 0.0
+    if cores < 1:
+        # Less than a core only time-slices the serial speed
+        return cores
+    return 1 / ((1 - parallel_fraction) + parallel_fraction / cores)
+
+def predict_runtime(profile: JobProfile, cores: float, threads: int) -> float:
+    return profile.runtime / speedup(profile.parallel_fraction, cores, threads)
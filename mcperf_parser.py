@@ -0,0 +1,158 @@
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+# mcperf output comes in two shapes. Part 3's runs print the measurement
+# window of every line in the ts_start/ts_end columns (epoch milliseconds):
+#   #type       avg     std ...     QPS   target       ts_start         ts_end
+#   read      341.2   216.7 ...  29986.0    30000  1715721091405  1715721101568
+# Part 4's runs print no per-line times, only the whole run's window in a
+# header, possibly after a few lines describing the load:
+#   Timestamp start: 1715963773181
+#   Timestamp end: 1715964553701
+#
+#   #type       avg     std ...     QPS   target
+# Columns are looked up by name in the #type line; until one comes by, the
+# part 4 layout below is assumed.
+DEFAULT_HEADER = ['#type', 'avg', 'std', 'min', 'p5', 'p10', 'p50', 'p67', 'p75', 'p80', 'p85', 'p90',
+                  'p95', 'p99', 'p999', 'p9999', 'QPS', 'target']
+
+class McperfRow(NamedTuple):
+    # Latencies in µs, as printed by mcperf
+    avg: float
+    p95: float
+    qps: float
+    target: float
+    # Epoch milliseconds, only in part 3's output
+    ts_start: Optional[int]
+    ts_end: Optional[int]
+
+class McperfParser:
+    def __init__(self):
+        self.columns: List[str] = DEFAULT_HEADER[1:]
+        self.index: Dict[str, int] = {}
+        self.timestamp_start: Optional[int] = None
+        self.timestamp_end: Optional[int] = None
+        self._set_header(DEFAULT_HEADER)
+
+    def _set_header(self, fields: List[str]):
+        self.columns = fields[1:]
+        self.index = {name: index for index, name in enumerate(self.columns)}
+
+    def parse_line(self, line: str) -> Optional[List[float]]:
+        # Values of a measurement line in self.columns order, None for
+        # headers, descriptions and lines cut short
+        if line.startswith('Timestamp start:'):
+            self.timestamp_start = int(line.split(':', 1)[1])
+        elif line.startswith('Timestamp end:'):
+            self.timestamp_end = int(line.split(':', 1)[1])
+        elif line.startswith('#type'):
+            self._set_header(line.split())
+        elif line.startswith('read'):
+            fields = line.split()
+            if len(fields) == len(self.columns) + 1:
+                try:
+                    return [float(field) for field in fields[1:]]
+                except ValueError:
+                    return None
+        return None
+
+    def row(self, values: List[float]) -> McperfRow:
+        ts_start = self.index.get('ts_start')
+        ts_end = self.index.get('ts_end')
+        return McperfRow(values[self.index['avg']], values[self.index['p95']], values[self.index['QPS']],
+                         values[self.index['target']],
+                         int(values[ts_start]) if ts_start is not None else None,
+                         int(values[ts_end]) if ts_end is not None else None)
+
+    def values(self, lines: Iterable[str]) -> Iterator[List[float]]:
+        for line in lines:
+            values = self.parse_line(line)
+            if values is not None:
+                yield values
+
+class McperfFile:
+    def __init__(self, path: str):
+        self.path = path
+        self.parser = McperfParser()
+
+    @property
+    def timestamp_start(self) -> Optional[int]:
+        return self.parser.timestamp_start
+
+    @property
+    def timestamp_end(self) -> Optional[int]:
+        return self.parser.timestamp_end
+
+    @property
+    def columns(self) -> List[str]:
+        return self.parser.columns
+
+    def _lines(self) -> Iterator[str]:
+        # A line without its newline may still be in the middle of being
+        # written, so it is left for the next pass
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.endswith('\n'):
+                    yield line
+
+    def rows(self) -> Iterator[McperfRow]:
+        for values in self.parser.values(self._lines()):
+            yield self.parser.row(values)
+
+    def count(self) -> int:
+        # Number of rows; also fills in the header timestamps wherever they are
+        return sum(1 for _ in self.parser.values(self._lines()))
+
+    def interval(self, rows: Optional[List[McperfRow]] = None, default: float = 10.0) -> float:
+        # Seconds per row, from part 3's ts columns or part 4's header; rows
+        # already read from this file save a second pass
+        rows = rows if rows is not None else list(self.rows())
+        if rows and rows[0].ts_start is not None:
+            return (rows[-1].ts_end - rows[0].ts_start) / 1000 / len(rows)
+        if rows and self.timestamp_start is not None and self.timestamp_end is not None:
+            return (self.timestamp_end - self.timestamp_start) / 1000 / len(rows)
+        return default
+
+    def follow(self, stopped: Optional[threading.Event] = None, poll: float = 0.5) -> Iterator[McperfRow]:
+        # Like tail -f: yields rows as they are appended until stopped is set,
+        # and starts over when the file is truncated by a new run
+        stopped = stopped if stopped is not None else threading.Event()
+        file = None
+        position = 0
+        partial = ''
+        try:
+            while not stopped.is_set():
+                if file is None:
+                    try:
+                        file = open(self.path, 'r', encoding='utf-8')
+                    except FileNotFoundError:
+                        stopped.wait(poll)
+                        continue
+                if os.fstat(file.fileno()).st_size < position:
+                    file.seek(0)
+                    partial = ''
+                    self.parser = McperfParser()
+                data = file.read()
+                position = file.tell()
+                if not data:
+                    stopped.wait(poll)
+                    continue
+                lines = (partial + data).split('\n')
+                partial = lines.pop()
+                for values in self.parser.values(lines):
+                    yield self.parser.row(values)
+        finally:
+            if file is not None:
+                file.close()
+
+    def arrays(self) -> Dict[str, 'np.ndarray']:
+        # Every column by its #type name, filled in a single pass
+        import numpy as np
+        rows = list(self.parser.values(self._lines()))
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.columns))
+        arrays = {name: table[:, index] for index, name in enumerate(self.columns)}
+        for name in ['ts_start', 'ts_end']:
+            if name in arrays:
+                arrays[name] = arrays[name].astype(np.int64)
+        return arrays
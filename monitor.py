@@ -0,0 +1,168 @@
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from typing import Any, List, Optional
+from recorder import CsvSink, close_on_exit, record_struct
+from telemetry import ProcBackend, Sampler, window_between
+
+# Node monitor replacing performance.py and performance_memcached.py, e.g.
+#   python3 monitor.py --pid $MEMCACHED_PID --rate 10
+# prints one tab-separated line per sample:
+#   time mem [mcpu] packets cpu0 ... cpuN [cgroups...]
+# with the time in epoch seconds, CPU and memory in percent and packets
+# received per second, each averaged over the interval since the last line.
+# part4/plot1d.py and part4/fit_line.py read this layout.
+
+class BinarySink:
+    def __init__(self, path: str, columns: List[str], max_rows: int = 256, max_delay: float = 5.0):
+        # Fixed-width records in monitor.bin, described by meta.json; times
+        # are epoch nanoseconds
+        os.makedirs(path, exist_ok=True)
+        self.columns = [('time', '<i8')] + [(name, '<f8') for name in columns[1:]]
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                if json.load(file) != json.loads(json.dumps({'monitor': self.columns})):
+                    raise ValueError(f'{path} holds a recording with different columns')
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as file:
+                json.dump({'monitor': self.columns}, file, indent=2)
+        self.struct = record_struct(self.columns)
+        self.file = open(os.path.join(path, 'monitor.bin'), 'ab')
+        self.buffer = bytearray()
+        self.rows = 0
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.last_flush = time.monotonic()
+
+    def write(self, data: List[Any]):
+        self.buffer += self.struct.pack(int(data[0] * 1e9), *data[1:])
+        self.rows += 1
+        if self.rows >= self.max_rows or time.monotonic() - self.last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+class TextSink(CsvSink):
+    def write(self, data: List[Any]):
+        super().write([f'{data[0]:.6f}', *[f'{value:.2f}' for value in data[1:]]])
+
+def load_monitor(path: str):
+    import numpy as np
+    with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    dtype = np.dtype([(name, kind) for name, kind in meta['monitor']])
+    table_path = os.path.join(path, 'monitor.bin')
+    count = os.path.getsize(table_path) // dtype.itemsize if os.path.exists(table_path) else 0
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(table_path, dtype=dtype, mode='r', shape=(count,))
+
+class Monitor:
+    def __init__(self, backend: ProcBackend, rate: float, has_process: bool, cgroups: List[str]):
+        self.backend = backend
+        self.sampler = Sampler(backend, 1 / rate)
+        self.period = 1 / rate
+        self.has_process = has_process
+        self.cgroups = cgroups
+        self.missed = 0
+
+    def columns(self) -> List[str]:
+        return ['time', 'mem'] + (['mcpu'] if self.has_process else []) + ['packets'] + \
+            [f'cpu{cpu}' for cpu in range(self.backend.num_cpus)] + self.cgroups
+
+    def run(self, sink, stopped: threading.Event, duration: Optional[float] = None):
+        previous = self.sampler.sample()
+        # Deadlines are whole periods from a start on a multiple of the
+        # period in wall-clock time, so samples line up with mcperf's
+        # buckets and never drift, however long each sample takes
+        start = time.monotonic() + self.period - time.time() % self.period
+        tick = 1
+        while not stopped.is_set():
+            deadline = start + tick * self.period
+            if duration is not None and deadline - start > duration:
+                return
+            if stopped.wait(max(0.0, deadline - time.monotonic())):
+                return
+            current = self.sampler.sample()
+            wall = time.time()
+            window = window_between(previous, current)
+            sink.write([wall, window.memory_percent] +
+                       ([window.memcached_cpu_percent] if self.has_process else []) +
+                       [window.packets_per_second] + window.cpu_percents +
+                       [window.container_cpu_percents.get(name, math.nan) for name in self.cgroups])
+            previous = current
+            # When a sample overran, skip the deadlines already passed
+            # instead of taking a burst of samples to catch up
+            late = int((time.monotonic() - start) / self.period)
+            self.missed += max(0, late - tick)
+            tick = max(tick + 1, late + 1)
+
+def parse_named(values: List[str], flag: str) -> List[List[str]]:
+    result = []
+    for value in values:
+        name, sep, target = value.partition('=')
+        if not sep or not name or not target:
+            raise ValueError(f'Expected {flag} NAME=VALUE, got {value}')
+        result.append([name, target])
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sample CPU, memory, network and cgroup usage at a fixed rate')
+    parser.add_argument('--pid', type=int, default=None, help='process to track, e.g. memcached')
+    parser.add_argument('--rate', type=float, default=1.0, help='samples per second, up to about 100')
+    parser.add_argument('--interface', default=None, help='only count packets on this interface')
+    parser.add_argument('--container', action='append', default=[], metavar='NAME=ID',
+        help='track the CPU usage of a Docker container')
+    parser.add_argument('--cgroup', action='append', default=[], metavar='NAME=PATH',
+        help='track the CPU usage of a cgroup directory')
+    parser.add_argument('--output', default='/dev/stdout', help='text output file')
+    parser.add_argument('--binary', default=None, metavar='DIR', help='write binary records to DIR instead')
+    parser.add_argument('--batch', type=int, default=None, help='samples per write, one second worth by default')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--header', action='store_true', help='start text output with a # line naming the columns')
+    args = parser.parse_args()
+    if args.rate <= 0 or args.rate > 1000:
+        raise ValueError(f'Sampling rate {args.rate} out of range')
+    backend = ProcBackend(args.pid, args.interface)
+    cgroups = []
+    for name, container_id in parse_named(args.container, '--container'):
+        backend.add_container(name, container_id)
+        cgroups.append(name)
+    for name, path in parse_named(args.cgroup, '--cgroup'):
+        backend.add_cgroup(name, path)
+        cgroups.append(name)
+    monitor = Monitor(backend, args.rate, args.pid is not None, cgroups)
+
+    batch = args.batch if args.batch is not None else max(1, int(args.rate))
+    if args.binary is not None:
+        sink = BinarySink(args.binary, monitor.columns(), batch, 1.0)
+    else:
+        sink = TextSink(args.output, batch, 1.0, '\t')
+        if args.header:
+            sink.file.write('#' + '\t'.join(monitor.columns()) + '\n')
+    close_on_exit(sink)
+    try:
+        monitor.run(sink, threading.Event(), args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.close()
+        backend.close()
+        if monitor.missed:
+            print(f'Missed {monitor.missed} samples', file=sys.stderr, flush=True)
@@ -8,13 +8,12 @@ LogTiming() {
     echo "$1: $(date +"%Y-%m-%d %H:%M:%S")" >> measurements/part3/timing.yaml
 }
 
-StartJob() {
-    kubectl create -f "part3/$1.yaml"
-}
-
 SetupPerformance() {
-    CopyToVM performance.py "$1:"
-    RunCommand "$1" "sudo apt-get update; sudo apt-get install tmux python3-pip --yes; sudo python3 -m pip install psutil; if ! tmux has-session -t performance 2>/dev/null; then tmux new-session -s performance -d 'python3 ~/performance.py > ~/performance.txt 2>&1'; fi" > /dev/null
+    for file in monitor.py telemetry.py cgroup.py recorder.py
+    do
+        CopyToVM $file "$1:"
+    done
+    RunCommand "$1" "sudo apt-get update; sudo apt-get install tmux python3-pip --yes; sudo python3 -m pip install psutil; if ! tmux has-session -t performance 2>/dev/null; then tmux new-session -s performance -d 'python3 ~/monitor.py --rate 10 --header > ~/performance.txt 2> ~/monitor.log'; fi" > /dev/null
 }
 
 GetPerformanceMeasurements() {
@@ -22,6 +21,12 @@ GetPerformanceMeasurements() {
     CopyFromVM "$1:performance.txt" measurements/part3/performance-$2.txt
 }
 
+if ! python3 -c 'import kubernetes, yaml' 2> /dev/null
+then
+    echo "Installing the scheduler's dependencies..."
+    python3 -m pip install kubernetes pyyaml
+fi
+
 GenerateSSHKey
 LogTiming start
 
@@ -88,66 +93,9 @@ RunCommand "$CLIENT_MEASURE_EXTERNAL_IP" "if ! tmux has-session -t mcperf 2>/dev
 
 LogTiming jobs_start
 
-echo "Starting jobs..."
-StartJob vips
-StartJob ferret
-StartJob dedup
-StartJob blackscholes
-StartJob freqmine
-StartJob radix
-StartJob canneal
-
+echo "Scheduling jobs..."
 TerminalBell
-
-dedup_done="no"
-radix_done="no"
-vips_done="no"
-blackscholes_done="no"
-canneal_done="no"
-ferret_done="no"
-freqmine_done="no"
-all_done="no"
-while [ "$all_done" != "yes" ]
-do
-    sleep 1
-    PODS_INFO=`kubectl get pods -o wide`
-    clear
-    echo "====================================================================="
-    echo "$PODS_INFO"
-    JOB_INFO=`kubectl get jobs`
-    if [ "$dedup_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-dedup | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        dedup_done="yes"
-    fi
-    if [ "$radix_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-radix | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        radix_done="yes"
-    fi
-    if [ "$vips_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-vips | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        vips_done="yes"
-    fi
-    if [ "$blackscholes_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-blackscholes | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        blackscholes_done="yes"
-    fi
-    if [ "$canneal_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-canneal | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        canneal_done="yes"
-    fi
-    if [ "$ferret_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-ferret | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        ferret_done="yes"
-    fi
-    if [ "$freqmine_done" == "no" ] && [ "$(echo "$JOB_INFO" | grep part3-freqmine | tr -s ' ' | cut -d' ' -f2)" == "1/1" ]
-    then
-        freqmine_done="yes"
-    fi
-    if [ "$dedup_done" == "yes" ] && [ "$radix_done" == "yes" ] && [ "$ferret_done" == "yes" ] && [ "$vips_done" == "yes" ] && [ "$freqmine_done" == "yes" ] && [ "$canneal_done" == "yes" ] && [ "$blackscholes_done" == "yes" ]
-    then
-        all_done="yes"
-    fi
-done
+python3 part3_scheduler.py
 
 echo "All jobs done!"
 
@@ -0,0 +1,211 @@
+import argparse
+import copy
+import heapq
+import random
+import re
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+from job_profiles import PROFILES, JobProfile, predict_runtime, speedup
+
+# Places part 3's PARSEC jobs on the cluster as cores free up, instead of
+# creating all of them at once with fixed node selectors. Needs the
+# kubernetes package (pip install kubernetes) and the kubectl context kops
+# set up, which part3.sh takes care of. Without a cluster,
+# --fake replays the same decisions against simulated jobs:
+#   python3 part3_scheduler.py --fake --seed 1
+
+NODES: Dict[str, int] = {'node-a-2core': 2, 'node-b-4core': 4, 'node-c-8core': 8}
+MEMCACHED_NODE = 'node-a-2core'
+# Every node part3.yaml labels with cca-project-nodetype, the mcperf clients
+# included
+CLUSTER: Dict[str, int] = {'client-measure': 2, 'client-agent-a': 2, 'client-agent-b': 4, **NODES}
+JOBS = ['blackscholes', 'canneal', 'dedup', 'ferret', 'freqmine', 'radix', 'vips']
+
+class JobEvent(NamedTuple):
+    name: str
+    # 'succeeded' or 'failed'
+    state: str
+    time: float
+
+class Placement(NamedTuple):
+    job: str
+    node: str
+    cpus: List[int]
+    start: float
+
+def load_templates(directory: str) -> Dict[str, Dict[str, Any]]:
+    import yaml
+    templates = {}
+    for job in JOBS:
+        with open(f'{directory}/{job}.yaml', 'r', encoding='utf-8') as file:
+            templates[job] = yaml.safe_load(file)
+    return templates
+
+def job_manifest(template: Dict[str, Any], node: str, cpus: List[int]) -> Dict[str, Any]:
+    # The template's job pinned to cpus on node, with one thread per CPU
+    manifest = copy.deepcopy(template)
+    pod = manifest['spec']['template']['spec']
+    pod['nodeSelector'] = {'cca-project-nodetype': node}
+    container = pod['containers'][0]
+    command = re.sub(r'^taskset -c \S+ ', '', container['args'][-1])
+    command = re.sub(r'-n \d+', f'-n {len(cpus)}', command)
+    container['args'][-1] = f'taskset -c {",".join([str(cpu) for cpu in cpus])} {command}'
+    return manifest
+
+def manifest_placement(manifest: Dict[str, Any]) -> Tuple[str, List[int], int]:
+    container = manifest['spec']['template']['spec']['containers'][0]
+    command = container['args'][-1]
+    cpus = [int(cpu) for cpu in re.search(r'taskset -c (\S+)', command).group(1).split(',')]
+    threads = int(re.search(r'-n (\d+)', command).group(1))
+    return re.search(r'-p (\S+)', command).group(1), cpus, threads
+
+def job_nodes(cluster: Dict[str, int], memcached_node: str) -> Dict[str, int]:
+    # Only the nodes meant for the jobs, whose images the prepuller fetched,
+    # less the one memcached has to itself
+    return {node: cpus for node, cpus in cluster.items() if node in NODES and node != memcached_node}
+
+class KubernetesApi:
+    def __init__(self, namespace: str = 'default'):
+        from kubernetes import client, config, watch
+        config.load_kube_config()
+        self.batch = client.BatchV1Api()
+        self.core = client.CoreV1Api()
+        self.watch = watch
+        self.exception = client.exceptions.ApiException
+        self.namespace = namespace
+
+    def time(self) -> float:
+        return time.time()
+
+    def nodes(self) -> Dict[str, int]:
+        result = {}
+        for node in self.core.list_node().items:
+            nodetype = (node.metadata.labels or {}).get('cca-project-nodetype')
+            if nodetype is not None:
+                result[nodetype] = int(node.status.capacity['cpu'])
+        return result
+
+    def create_job(self, manifest: Dict[str, Any]):
+        self.batch.create_namespaced_job(self.namespace, manifest)
+
+    def events(self) -> Iterator[JobEvent]:
+        # Watches jobs from the current state on; a watch times out now and
+        # then and resumes where it left off, or starts over when the API
+        # server no longer has that version
+        resource_version = None
+        while True:
+            stream = self.watch.Watch().stream(self.batch.list_namespaced_job, self.namespace,
+                                               resource_version=resource_version, timeout_seconds=60)
+            try:
+                for event in stream:
+                    job = event['object']
+                    resource_version = job.metadata.resource_version
+                    for condition in job.status.conditions or []:
+                        if condition.status == 'True' and condition.type in ('Complete', 'Failed'):
+                            state = 'succeeded' if condition.type == 'Complete' else 'failed'
+                            yield JobEvent(job.metadata.name, state, time.time())
+            except self.exception as error:
+                if error.status != 410:
+                    raise
+                resource_version = None
+
+class FakeApi:
+    def __init__(self, profiles: Dict[str, JobProfile], noise: float = 0.1, startup: float = 2.0, seed: int = 0):
+        # Jobs run for their profile's predicted runtime, give or take noise,
+        # on a virtual clock that jumps from one completion to the next
+        self.profiles = profiles
+        self.noise = noise
+        self.startup = startup
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.finishing: List[Tuple[float, str]] = []
+
+    def time(self) -> float:
+        return self.now
+
+    def nodes(self) -> Dict[str, int]:
+        return dict(CLUSTER)
+
+    def create_job(self, manifest: Dict[str, Any]):
+        job, cpus, threads = manifest_placement(manifest)
+        runtime = predict_runtime(self.profiles[job], len(cpus), threads)
+        runtime *= 1 + self.random.uniform(-self.noise, self.noise)
+        heapq.heappush(self.finishing, (self.now + self.startup + runtime, manifest['metadata']['name']))
+
+    def events(self) -> Iterator[JobEvent]:
+        while self.finishing:
+            self.now, name = heapq.heappop(self.finishing)
+            yield JobEvent(name, 'succeeded', self.now)
+
+class Part3Scheduler:
+    def __init__(self, api, templates: Dict[str, Dict[str, Any]], nodes: Dict[str, int],
+                 min_efficiency: float = 0.6):
+        self.api = api
+        self.templates = templates
+        self.free: Dict[str, List[int]] = {node: list(range(cpus)) for node, cpus in nodes.items()}
+        self.min_efficiency = min_efficiency
+        # Longest jobs first, so the last ones to finish are short
+        self.waiting = sorted(templates, key=lambda job: PROFILES[job].runtime, reverse=True)
+        self.running: Dict[str, Placement] = {}
+        self.finished: Dict[str, Tuple[Placement, float, str]] = {}
+
+    def cores_for(self, job: str, free: int) -> int:
+        # The most cores, in powers of two as radix needs, that still speed
+        # the job up by at least min_efficiency per core
+        profile = PROFILES[job]
+        cores = 1
+        while cores * 2 <= free and \
+                speedup(profile.parallel_fraction, cores * 2, cores * 2) / (cores * 2) >= self.min_efficiency:
+            cores *= 2
+        return cores
+
+    def dispatch(self):
+        while self.waiting:
+            node = max(self.free, key=lambda node: len(self.free[node]))
+            if not self.free[node]:
+                return
+            job = self.waiting.pop(0)
+            cores = self.cores_for(job, len(self.free[node]))
+            cpus = self.free[node][:cores]
+            self.free[node] = self.free[node][cores:]
+            manifest = job_manifest(self.templates[job], node, cpus)
+            self.api.create_job(manifest)
+            self.running[manifest['metadata']['name']] = Placement(job, node, cpus, self.api.time())
+            print(f'Started {job} on {node} CPUs {",".join([str(cpu) for cpu in cpus])}', flush=True)
+
+    def run(self) -> float:
+        start = self.api.time()
+        self.dispatch()
+        for event in self.api.events():
+            placement = self.running.pop(event.name, None)
+            if placement is None:
+                # Not ours, or already seen
+                continue
+            self.free[placement.node] = sorted(self.free[placement.node] + placement.cpus)
+            self.finished[placement.job] = (placement, event.time, event.state)
+            print(f'Job {placement.job} {event.state} after {event.time - placement.start:.1f}s', flush=True)
+            self.dispatch()
+            if not self.running and not self.waiting:
+                break
+        return self.api.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Schedule part 3 PARSEC jobs across the cluster as cores free up')
+    parser.add_argument('--templates', default='part3', help='directory with the jobs\' manifests')
+    parser.add_argument('--namespace', default='default')
+    parser.add_argument('--memcached-node', default=MEMCACHED_NODE, help='node left to memcached alone')
+    parser.add_argument('--min-efficiency', type=float, default=0.6,
+        help='smallest speedup per core worth giving a job more cores')
+    parser.add_argument('--fake', action='store_true', help='simulate the jobs instead of using the cluster')
+    parser.add_argument('--noise', type=float, default=0.1, help='relative runtime noise of --fake jobs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeApi(PROFILES, args.noise, seed=args.seed) if args.fake else KubernetesApi(args.namespace)
+    nodes = job_nodes(api.nodes(), args.memcached_node)
+    if not nodes:
+        raise ValueError('No nodes left for the jobs')
+    scheduler = Part3Scheduler(api, load_templates(args.templates), nodes, args.min_efficiency)
+    makespan = scheduler.run()
+    failed = [job for job, (_, _, state) in scheduler.finished.items() if state != 'succeeded']
+    print(f'All jobs done in {makespan:.1f}s' + (f', failed: {", ".join(failed)}' if failed else ''), flush=True)
@@ -18,7 +18,10 @@ MEMCACHED_INTERNAL_IP=`echo "$NODE_INFO" | grep memcache-server | tr -s ' ' | cu
 echo "Setting up tools..."
 SetupMcperf "$CLIENT_MEASURE_EXTERNAL_IP" &
 SetupMcperf "$CLIENT_AGENT_EXTERNAL_IP" &
-CopyToVM performance_memcached.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM monitor.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM telemetry.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM cgroup.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM recorder.py "$MEMCACHED_EXTERNAL_IP:"
 RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo apt-get update; sudo apt-get install -y tmux python3-pip memcached libmemcached-tools; sudo python3 -m pip install psutil" > /dev/null
 wait
 
@@ -38,7 +41,7 @@ do
             MEMCACHED_PID=`RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo systemctl status memcached | grep 'Main PID:' | tr -s ' ' | cut -d' ' -f4"`
             echo "Detected Memcached running on PID $MEMCACHED_PID."
             RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo taskset -a -cp $taskset_cpus $MEMCACHED_PID"
-            (RunCommand "$MEMCACHED_EXTERNAL_IP" "python3 ~/performance_memcached.py $MEMCACHED_PID" | tee "measurements/part4/performance-c$cores-t$threads-$run.txt" &)
+            (RunCommand "$MEMCACHED_EXTERNAL_IP" "python3 ~/monitor.py --pid $MEMCACHED_PID --rate 10 --header" | tee "measurements/part4/performance-c$cores-t$threads-$run.txt" &)
 
             echo "Starting mcperf..."
             RunCommand "$CLIENT_AGENT_EXTERNAL_IP" "if ! tmux has-session -t mcperf 2>/dev/null; then tmux new-session -s mcperf -d '~/memcache-perf/mcperf -T 16 -A'; fi"
@@ -6,7 +6,7 @@ KillPreviousMcperf() {
 }
 
 source common.sh
-mkdir -p measurements/part4
+mkdir -p measurements/part4/recording
 GenerateSSHKey
 CreateKubernetesCluster part4
 TerminalBell
@@ -22,7 +22,7 @@ MEMCACHED_INTERNAL_IP=`echo "$NODE_INFO" | grep memcache-server | tr -s ' ' | cu
 echo "Setting up tools..."
 SetupMcperf "$CLIENT_MEASURE_EXTERNAL_IP" &
 SetupMcperf "$CLIENT_AGENT_EXTERNAL_IP" &
-RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo apt-get update; sudo apt-get install -y tmux python3-pip memcached libmemcached-tools docker.io; sudo python3 -m pip install psutil docker; sudo groupadd -f docker; sudo usermod -aG docker ubuntu; sudo bash -c 'docker kill \$(docker ps -q) || true; docker container prune -f'; sudo rm -rf ~/logs ~/utilization.csv ~/jobs.csv" > /dev/null
+RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo apt-get update; sudo apt-get install -y tmux python3-pip memcached libmemcached-tools docker.io; sudo python3 -m pip install psutil docker pyyaml; sudo groupadd -f docker; sudo usermod -aG docker ubuntu; sudo bash -c 'docker kill \$(docker ps -q) || true; docker container prune -f'; sudo rm -rf ~/logs ~/utilization.csv ~/jobs.csv ~/provisioning.csv ~/pauses.csv ~/affinity.csv ~/recording" > /dev/null
 for job in blackscholes canneal dedup ferret freqmine radix vips
 do
     if [ "$job" == "radix" ]
@@ -47,7 +47,22 @@ RunCommand "$CLIENT_AGENT_EXTERNAL_IP" "tmux new-session -s mcperf -d '~/memcach
 RunCommand "$CLIENT_MEASURE_EXTERNAL_IP" "~/memcache-perf/mcperf -s $MEMCACHED_INTERNAL_IP --loadonly; tmux new-session -s mcperf -d '~/memcache-perf/mcperf -s $MEMCACHED_INTERNAL_IP -a $CLIENT_AGENT_INTERNAL_IP --noload -T 16 -C 4 -D 4 -Q 1000 -c 4 -t 780 --qps_interval 10 --qps_min 5000 --qps_max 100000 --qps_seed 3274 > ~/mcperf.txt 2>&1'"
 
 CopyToVM part4.py "$MEMCACHED_EXTERNAL_IP:~/scheduler.py"
-RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo python3 ~/scheduler.py $MEMCACHED_PID"
+CopyToVM telemetry.py "$MEMCACHED_EXTERNAL_IP:~/telemetry.py"
+CopyToVM cgroup.py "$MEMCACHED_EXTERNAL_IP:~/cgroup.py"
+CopyToVM recorder.py "$MEMCACHED_EXTERNAL_IP:~/recorder.py"
+CopyToVM qps_predictor.py "$MEMCACHED_EXTERNAL_IP:~/qps_predictor.py"
+CopyToVM policy.py "$MEMCACHED_EXTERNAL_IP:~/policy.py"
+RunCommand "$MEMCACHED_EXTERNAL_IP" "mkdir -p ~/policies"
+for file in policies/*
+do
+    CopyToVM "$file" "$MEMCACHED_EXTERNAL_IP:~/policies/"
+done
+CopyToVM core_allocator.py "$MEMCACHED_EXTERNAL_IP:~/core_allocator.py"
+CopyToVM job_profiles.py "$MEMCACHED_EXTERNAL_IP:~/job_profiles.py"
+CopyToVM irq_affinity.py "$MEMCACHED_EXTERNAL_IP:~/irq_affinity.py"
+CopyToVM slo_feedback.py "$MEMCACHED_EXTERNAL_IP:~/slo_feedback.py"
+CopyToVM mcperf_parser.py "$MEMCACHED_EXTERNAL_IP:~/mcperf_parser.py"
+RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo python3 ~/scheduler.py $MEMCACHED_PID --record ~/recording"
 
 echo "Waiting for mcperf to finish..."
 while RunCommand "$CLIENT_MEASURE_EXTERNAL_IP" "tmux has-session -t mcperf 2>/dev/null"
@@ -57,6 +72,12 @@ done
 RunCommand "$CLIENT_AGENT_EXTERNAL_IP" "tmux kill-session -t mcperf"
 CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/jobs.csv" measurements/part4
 CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/utilization.csv" measurements/part4
+CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/provisioning.csv" measurements/part4
+CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/pauses.csv" measurements/part4
+CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/affinity.csv" measurements/part4
+CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/recording/meta.json" measurements/part4/recording
+CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/recording/utilization.bin" measurements/part4/recording
+CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/recording/events.bin" measurements/part4/recording
 CopyFromVM "$MEMCACHED_EXTERNAL_IP:~/logs/*.log" measurements/part4
 CopyFromVM "$CLIENT_MEASURE_EXTERNAL_IP:~/mcperf.txt" measurements/part4
 
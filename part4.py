@@ -1,33 +1,84 @@
+import argparse
+import concurrent.futures
+import contextlib
 import datetime
 from enum import IntEnum
-from typing import Any, Iterable, List, Optional
+import math
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 import docker
 from docker.models.containers import Container
 import os
 import psutil
 import sys
+import time
+from cgroup import find_container_cgroup, freeze_cgroup, is_cgroup_v2, write_cpu_limits
+from core_allocator import CoreAllocator
+from irq_affinity import NetworkAffinity
+from policy import Policy, load_policy
+from qps_predictor import CPU_LINE, NET_LINE, MemcachedStats, make_predictor
+from recorder import ColumnarRecorder, CsvSink, close_on_exit
+from slo_feedback import LatencyFeed, LatencySample, open_feed
+from telemetry import ProcBackend, PsutilBackend, Sampler
 
 time_format = '%Y-%m-%dT%H:%M:%S.%f'
+CPU_PERIOD = 100000
 
 class Job:
+    # Write cpusets and quotas straight into the container's cgroup v2
+    # directory instead of asking dockerd to do it
+    cgroup_writes = False
+    # How pause() stops a job: docker pause, freezing its cgroup v2 directly
+    # or throttling it to throttle_quota cores so it keeps making progress
+    pause_mode = 'docker'
+    throttle_quota = 0.05
+    pause_log: Optional[CsvSink] = None
+    recorder: Optional[ColumnarRecorder] = None
+
     def __init__(self, name: str, benchmark: str):
         self.name: str = name
         self.benchmark: str = benchmark
         self.cpus: List[int] = []
+        self.quota = 0.0
         self.finished = False
+        # Local state table, only filled in when following Docker events
+        self.tracked = False
+        self.state: Optional[str] = None
+        self.started_at: Optional[datetime.datetime] = None
+        self.finished_at: Optional[datetime.datetime] = None
+        self.state_lock = threading.Lock()
+        # Seconds the Docker API took to create and start the container
+        self.create_latency: Optional[float] = None
+        self.start_latency: Optional[float] = None
+        # Last (cpuset, quota in µs per period) that reached the container
+        self.applied: Optional[Tuple[Tuple[int, ...], int]] = None
+        self.cgroup: Optional[str] = None
+        # 'freeze' or 'throttle' while paused without Docker knowing about it
+        self.held_by: Optional[str] = None
+        self.paused_at: Optional[float] = None
 
     def status(self) -> str:
-        return self.container.attrs['State']['Status']
+        if self.tracked and self.state is not None:
+            status = self.state
+        else:
+            status = self.container.attrs['State']['Status']
+        if status == 'running' and self.held_by is not None:
+            return 'paused'
+        return status
 
     def start_time(self) -> datetime.datetime:
         if self.status() != 'running' and self.status() != 'exited':
             return datetime.datetime.now()
+        elif self.started_at is not None:
+            return self.started_at
         else:
             return datetime.datetime.strptime(self.container.attrs['State']['StartedAt'][:-4], time_format)
 
     def end_time(self) -> datetime.datetime:
         if self.status() != 'exited':
             return datetime.datetime.now()
+        elif self.finished_at is not None:
+            return self.finished_at
         else:
             return datetime.datetime.strptime(self.container.attrs['State']['FinishedAt'][:-4], time_format)
 
@@ -36,10 +87,22 @@ class Job:
             return 0.0
         return (self.end_time() - self.start_time()).total_seconds()
 
-    def create(self, client: docker.DockerClient, num_threads: int):
+    def create(self, client: docker.DockerClient, num_threads: int, cpus: Optional[List[int]] = None):
         image = f'anakli/cca:{self.benchmark}_{self.name}'
         cmd = f'./run -a run -S {self.benchmark} -p {self.name} -i native -n {num_threads}'
-        self.container: Container = client.containers.create(image, cmd, detach=True, name=self.name)
+        config = {}
+        if cpus is not None:
+            # Create the container already pinned, so starting it later
+            # does not need a separate update
+            self.cpus = cpus
+            self.quota = len(cpus)
+            config = {'cpuset_cpus': ','.join([str(cpu) for cpu in cpus]),
+                      'cpu_period': CPU_PERIOD, 'cpu_quota': len(cpus) * CPU_PERIOD}
+        begin = time.monotonic()
+        self.container: Container = client.containers.create(image, cmd, detach=True, name=self.name, **config)
+        self.create_latency = time.monotonic() - begin
+        if cpus is not None:
+            self.applied = (tuple(cpus), len(cpus) * CPU_PERIOD)
 
     def get_cpus(self) -> List[int]:
         if self.status() == 'running':
@@ -48,32 +111,187 @@ class Job:
 
     def set_cpus(self, cpus: List[int], cpu_usage: Optional[float] = None):
         self.cpus = cpus
-        self.container.update(cpuset_cpus=','.join([str(cpu) for cpu in cpus]),
-            cpu_period=100000,
-            cpu_quota=int((cpu_usage if cpu_usage is not None else len(cpus)) * 100000))
+        self.quota = cpu_usage if cpu_usage is not None else len(cpus)
+        if pending_updates is not None:
+            pending_updates[self.name] = self
+        else:
+            self.apply_cpus()
+
+    def _cgroup_path(self) -> Optional[str]:
+        if self.cgroup is None:
+            # The cgroup only exists once the container was started
+            self.cgroup = find_container_cgroup(self.container.id)
+        return self.cgroup
+
+    def apply_cpus(self):
+        quota = Job.throttle_quota if self.held_by == 'throttle' else self.quota
+        target = (tuple(self.cpus), int(quota * CPU_PERIOD))
+        if target == self.applied:
+            return
+        if not (Job.cgroup_writes and self._write_cgroup(target[1])):
+            self.container.update(cpuset_cpus=','.join([str(cpu) for cpu in self.cpus]),
+                cpu_period=CPU_PERIOD,
+                cpu_quota=target[1])
+        self.applied = target
+        self.record('cores')
+
+    def _write_cgroup(self, quota: int) -> bool:
+        if self._cgroup_path() is None:
+            return False
+        try:
+            write_cpu_limits(self.cgroup, self.cpus, quota, CPU_PERIOD)
+            return True
+        except OSError:
+            self.cgroup = None
+            return False
+
+    def record(self, kind: str, time_ns: Optional[int] = None):
+        if Job.recorder is None:
+            return
+        cpus, quota = self.applied if self.applied is not None else ((), 0)
+        Job.recorder.write_event(time.time_ns() if time_ns is None else time_ns, self.name, kind,
+            cpus, quota / CPU_PERIOD)
 
     def start(self):
+        self._flush_cpus()
+        begin = time.monotonic()
         self.container.start()
-        self.container.reload()
+        self.start_latency = time.monotonic() - begin
+        self._assume_state('running')
+        self.record('start')
 
     def pause(self):
-        self.container.pause()
-        self.container.reload()
+        begin = time.monotonic()
+        if Job.pause_mode == 'throttle':
+            # Held first, so the pending cores go out together with the
+            # throttled quota in one update, never at full quota in between
+            self.held_by = 'throttle'
+        self._flush_cpus()
+        if self.held_by == 'throttle':
+            self.apply_cpus()
+        elif Job.pause_mode == 'freeze' and self._freeze(True):
+            self.held_by = 'freeze'
+        else:
+            self.container.pause()
+            self._assume_state('paused')
+        self.paused_at = time.monotonic()
+        self.record('pause')
+        self._log_pause('pause', self.held_by or 'docker', begin)
 
     def unpause(self):
-        self.container.unpause()
-        self.container.reload()
+        begin = time.monotonic()
+        held_by, self.held_by = self.held_by, None
+        self._flush_cpus()
+        if held_by == 'throttle':
+            self.apply_cpus()
+        elif held_by == 'freeze':
+            self._freeze(False)
+        else:
+            self.container.unpause()
+            self._assume_state('running')
+        self.record('unpause')
+        self._log_pause('resume', held_by or 'docker', begin)
+        self.paused_at = None
 
-    def finish(self):
+    def _freeze(self, frozen: bool) -> bool:
+        if self._cgroup_path() is None:
+            return False
+        try:
+            freeze_cgroup(self.cgroup, frozen)
+            return True
+        except OSError:
+            self.cgroup = None
+            return False
+
+    def _log_pause(self, action: str, mode: str, begin: float):
+        if Job.pause_log is None:
+            return
+        end = time.monotonic()
+        paused = lost = ''
+        if action == 'resume' and self.paused_at is not None:
+            # Cores the job was entitled to but did not get while paused
+            remaining = Job.throttle_quota if mode == 'throttle' else 0.0
+            paused = f'{begin - self.paused_at:.3f}'
+            lost = f'{(begin - self.paused_at) * max(0.0, self.quota - remaining):.3f}'
+        Job.pause_log.write([datetime.datetime.now().isoformat(), self.name, action, mode,
+            f'{(end - begin) * 1000:.2f}', paused, lost])
+
+    def _flush_cpus(self):
+        # Start and resume on the new cores, not on the ones from before
+        if pending_updates is not None and pending_updates.pop(self.name, None) is not None:
+            self.apply_cpus()
+
+    def _assume_state(self, state: str):
+        if self.tracked:
+            self._set_state(state)
+        else:
+            # The call returned, so there is nothing new to learn from a
+            # reload; the next update() fetches the timestamps anyway
+            self.container.attrs['State']['Status'] = state
+
+    def _set_state(self, state: str):
+        # The API call returned, so the daemon already applied the change,
+        # but the matching event may still be in flight. Never let such an
+        # optimistic update resurrect a container whose `die` was seen.
+        with self.state_lock:
+            if self.state == 'exited':
+                return
+            if state == 'running' and self.started_at is None:
+                self.started_at = datetime.datetime.utcnow()
+            self.state = state
+
+    def on_event(self, action: str, time_nano: int):
+        timestamp = datetime.datetime.fromtimestamp(time_nano / 1e9, datetime.timezone.utc).replace(tzinfo=None)
+        with self.state_lock:
+            if action == 'start':
+                self.started_at = timestamp
+                self.state = 'running'
+            elif action == 'die':
+                self.finished_at = timestamp
+                self.state = 'exited'
+            elif action == 'pause' and self.state != 'exited':
+                self.state = 'paused'
+            elif action == 'unpause' and self.state != 'exited':
+                self.state = 'running'
+
+    def finish(self, jobs_file: CsvSink):
         self.container.reload()
-        with open(f'logs/{job.name}.log', 'wb') as logs_file:
+        with open(f'logs/{self.name}.log', 'wb') as logs_file:
             logs_file.write(self.container.logs())
-        with open('jobs.csv', 'a', encoding='utf-8') as jobs_file:
-            jobs_file.write(f'{self.name},{self.start_time().isoformat()},{self.end_time().isoformat()}\n')
+        jobs_file.write([self.name, self.start_time().isoformat(), self.end_time().isoformat()])
         self.container.remove()
 
     def update(self):
-        self.container.reload()
+        if not self.tracked:
+            self.container.reload()
+
+class ContainerEvents:
+    ACTIONS = ['start', 'die', 'pause', 'unpause']
+
+    def __init__(self, client: docker.DockerClient, jobs: Iterable[Job], changed: Optional[threading.Event] = None):
+        self.jobs: Dict[str, Job] = {job.name: job for job in jobs}
+        self.changed = changed if changed is not None else threading.Event()
+        self.stream = client.events(decode=True, filters={'type': 'container', 'event': self.ACTIONS})
+        self.thread = threading.Thread(target=self._run, name='container-events', daemon=True)
+
+    def start(self):
+        # Seed the state table once, every later change arrives as an event
+        for_each_job(lambda job: job.container.reload(), self.jobs.values())
+        for job in self.jobs.values():
+            job.state = job.container.attrs['State']['Status']
+            job.tracked = True
+        self.thread.start()
+
+    def _run(self):
+        for event in self.stream:
+            job = self.jobs.get(event.get('Actor', {}).get('Attributes', {}).get('name'))
+            if job is None:
+                continue
+            job.on_event(event['Action'], event['timeNano'])
+            self.changed.set()
+
+    def close(self):
+        self.stream.close()
 
 # Constants
 JOBS = {
@@ -86,6 +304,33 @@ JOBS = {
     'vips': Job('vips', 'parsec')
 }
 
+# Every Docker API call is a blocking round-trip to dockerd, so calls for
+# different containers go out concurrently
+DOCKER_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=len(JOBS), thread_name_prefix='docker')
+
+def for_each_job(action: Callable[[Job], Any], jobs: Iterable[Job]) -> List[Any]:
+    futures = [DOCKER_POOL.submit(action, job) for job in jobs]
+    return [future.result() for future in futures]
+
+# Jobs whose set_cpus calls are held back until the end of batched_updates()
+pending_updates: Optional[Dict[str, Job]] = None
+
+@contextlib.contextmanager
+def batched_updates():
+    # Strategies move several jobs at once; only the last cpuset of each job
+    # is applied, unchanged ones are skipped and the rest go out together
+    global pending_updates
+    if pending_updates is not None:
+        yield
+        return
+    pending_updates = {}
+    try:
+        yield
+    finally:
+        jobs = list(pending_updates.values())
+        pending_updates = None
+        for_each_job(Job.apply_cpus, jobs)
+
 class LoadLevel(IntEnum):
     LOW = 0
     MEDIUM = 1
@@ -101,9 +346,165 @@ class Strategy1State(IntEnum):
     FREQMINE = 6
     FINISH = 7
 
+class ThresholdController:
+    def __init__(self, thresholds: Tuple[float, float] = (25000, 30000)):
+        self.thresholds = thresholds
+        self.changes = 0
+
+    def level_for(self, qps: float) -> LoadLevel:
+        if qps < self.thresholds[0]:
+            return LoadLevel.LOW
+        elif qps < self.thresholds[1]:
+            return LoadLevel.MEDIUM
+        else:
+            return LoadLevel.HIGH
+
+    def get_new_load_level(self, predicted_qps: float, load_level: LoadLevel, now: float) -> LoadLevel:
+        new_load_level = self.level_for(predicted_qps)
+        if new_load_level != load_level:
+            self.changes += 1
+        return new_load_level
+
+    def debug_lines(self) -> List[str]:
+        return [f'Level changes:    {self.changes}']
+
+class PredictiveController(ThresholdController):
+    def __init__(self, thresholds: Tuple[float, float] = (25000, 30000), hysteresis: float = 2000,
+                 up_dwell: float = 0.0, down_dwell: float = 5.0, horizon: float = 1.0,
+                 level_time_constant: float = 0.5, trend_time_constant: float = 2.0, flap_window: float = 10.0,
+                 transitions: Optional[CsvSink] = None):
+        super().__init__(thresholds)
+        self.hysteresis = hysteresis
+        self.up_dwell = up_dwell
+        self.down_dwell = down_dwell
+        self.horizon = horizon
+        self.level_time_constant = level_time_constant
+        self.trend_time_constant = trend_time_constant
+        self.flap_window = flap_window
+        self.transitions = transitions
+        # Holt's linear smoothing with time constants instead of per-sample
+        # factors, so it behaves the same at any sampling rate; trend in QPS/s
+        self.level: Optional[float] = None
+        self.trend = 0.0
+        self.last_sample: Optional[float] = None
+        self.last_change: Optional[float] = None
+        self.previous_level: Optional[LoadLevel] = None
+        # Metrics
+        self.crossed_at: Optional[float] = None
+        self.flaps = 0
+        self.preemptive = 0
+        self.reaction_times: List[float] = []
+
+    def forecast(self, qps: float, now: float) -> float:
+        if self.level is None or self.last_sample is None or now <= self.last_sample:
+            self.level = qps
+        else:
+            dt = now - self.last_sample
+            alpha = 1 - math.exp(-dt / self.level_time_constant)
+            beta = 1 - math.exp(-dt / self.trend_time_constant)
+            previous = self.level
+            self.level = alpha * qps + (1 - alpha) * (previous + self.trend * dt)
+            self.trend = beta * (self.level - previous) / dt + (1 - beta) * self.trend
+        self.last_sample = now
+        return self.level + self.trend * self.horizon
+
+    def get_new_load_level(self, predicted_qps: float, load_level: LoadLevel, now: float) -> LoadLevel:
+        forecast = self.forecast(predicted_qps, now)
+        # Grow as soon as either the sample or the forecast asks for it, only
+        # shrink once the forecast is clearly below the lower threshold
+        up = self.level_for(max(predicted_qps, forecast))
+        down = self.level_for(forecast + self.hysteresis)
+        if up > load_level:
+            new_load_level = up
+            dwell = self.up_dwell
+        elif down < load_level:
+            new_load_level = down
+            dwell = self.down_dwell
+        else:
+            new_load_level = load_level
+            dwell = 0.0
+
+        # Time-to-react is measured from the first raw sample that asked for a change
+        if self.level_for(predicted_qps) == load_level:
+            self.crossed_at = None
+        elif self.crossed_at is None:
+            self.crossed_at = now
+
+        if new_load_level == load_level or (self.last_change is not None and now - self.last_change < dwell):
+            return load_level
+        if self.crossed_at is None:
+            self.preemptive += 1
+            reaction = 0.0
+        else:
+            reaction = now - self.crossed_at
+        self.reaction_times.append(reaction)
+        if (self.previous_level == new_load_level and self.last_change is not None and
+                now - self.last_change < self.flap_window):
+            self.flaps += 1
+        if self.transitions is not None:
+            self.transitions.write([datetime.datetime.now().isoformat(), int(load_level), int(new_load_level),
+                predicted_qps, forecast, reaction, self.flaps])
+        self.changes += 1
+        self.previous_level = load_level
+        self.last_change = now
+        self.crossed_at = None
+        return new_load_level
+
+    def debug_lines(self) -> List[str]:
+        mean_reaction = sum(self.reaction_times) / len(self.reaction_times) if self.reaction_times else 0.0
+        return [
+            f'QPS forecast:     {(self.level or 0.0) + self.trend * self.horizon:.2f} (trend {self.trend:.2f}/s)',
+            f'Level changes:    {self.changes} ({self.flaps} flaps, {self.preemptive} pre-emptive)',
+            f'Mean reaction:    {mean_reaction * 1000:.1f} ms',
+        ]
+
+class SloFeedbackController:
+    def __init__(self, controller: ThresholdController, feed: LatencyFeed, target: float = 1000.0,
+                 tighten: float = 0.8, release: float = 0.5, max_age: float = 30.0):
+        # Wraps a QPS-based controller and never goes below a floor set from
+        # the p95 latency the measuring client actually observes
+        self.controller = controller
+        self.feed = feed
+        self.target = target
+        self.tighten = tighten
+        self.release = release
+        self.max_age = max_age
+        self.sample: Optional[LatencySample] = None
+        self.floor = LoadLevel.LOW
+        self.tightened = 0
+
+    def get_new_load_level(self, predicted_qps: float, load_level: LoadLevel, now: float) -> LoadLevel:
+        new_load_level = self.controller.get_new_load_level(predicted_qps, load_level, now)
+        sample = self.feed.latest()
+        if sample is None or now - sample.time > self.max_age:
+            # No news from the client, fall back to the QPS estimate alone
+            self.floor = LoadLevel.LOW
+        elif sample is not self.sample:
+            # Every measurement moves the floor at most once
+            self.sample = sample
+            if sample.p95 >= self.tighten * self.target:
+                self.floor = LoadLevel(min(LoadLevel.HIGH, max(load_level, new_load_level) + 1))
+                self.tightened += 1
+            elif sample.p95 <= self.release * self.target:
+                self.floor = LoadLevel.LOW
+        return max(new_load_level, self.floor)
+
+    def level_for(self, qps: float) -> LoadLevel:
+        return max(self.controller.level_for(qps), self.floor)
+
+    def debug_lines(self) -> List[str]:
+        observed = 'none'
+        if self.sample is not None:
+            observed = f'{self.sample.p95:.1f} us at {self.sample.qps:.0f} QPS'
+        return [
+            *self.controller.debug_lines(),
+            f'Observed p95:     {observed} (floor {self.floor.name}, tightened {self.tightened}x)',
+        ]
+
 class Strategy1:
-    def __init__(self):
+    def __init__(self, controller: Optional[ThresholdController] = None):
         self.state = Strategy1State.INIT
+        self.controller = controller if controller is not None else ThresholdController()
 
     def _get_current_mini_job(self) -> Optional[Job]:
         if JOBS['radix'].status() != 'exited':
@@ -237,22 +638,102 @@ class Strategy1:
             elif mini_job is not None:
                 mini_job.set_cpus([2, 3])
 
-    def get_new_load_level(self, predicted_qps: float, load_level: LoadLevel) -> LoadLevel:
-        if predicted_qps < 25000:
-            return LoadLevel.LOW
-        elif predicted_qps < 30000:
-            return LoadLevel.MEDIUM
+    def get_new_load_level(self, predicted_qps: float, load_level: LoadLevel, now: Optional[float] = None) -> LoadLevel:
+        return self.controller.get_new_load_level(predicted_qps, load_level, time.monotonic() if now is None else now)
+
+    def debug_lines(self) -> List[str]:
+        return [f'Strategy state:   {self.state}', *self.controller.debug_lines()]
+
+class PolicyStrategy:
+    def __init__(self, policy: Policy, controller: Optional[ThresholdController] = None):
+        self.policy = policy
+        self.controller = controller if controller is not None else ThresholdController()
+        self.started: Set[str] = set()
+
+    def _exited(self, name: str) -> bool:
+        return name in self.started and JOBS[name].status() == 'exited'
+
+    def _phase(self) -> FrozenSet[str]:
+        return frozenset(name for name in self.policy.dependencies if name in self.started and not self._exited(name))
+
+    def _current_background_job(self) -> Optional[Job]:
+        for name in self.policy.background:
+            if not self._exited(name):
+                return JOBS[name]
+        return None
+
+    def get_jobs_to_run(self) -> List[Job]:
+        new_jobs: List[Job] = []
+        for name, (mode, after) in self.policy.dependencies.items():
+            if name in self.started:
+                continue
+            exited = [self._exited(dependency) for dependency in after]
+            if any(exited) if mode == 'any' else all(exited):
+                new_jobs.append(JOBS[name])
+        background_job = self._current_background_job()
+        if background_job is not None and background_job.name not in self.started:
+            new_jobs.append(background_job)
+        self.started.update(job.name for job in new_jobs)
+        return new_jobs
+
+    def get_threads_for_job(self, job: Job) -> int:
+        return self.policy.threads.get(job.name, 1)
+
+    def get_init_cpuset_for_job(self, job: Job) -> List[int]:
+        return self.policy.init_cpus[job.name]
+
+    def update_load_level(self, load_level: LoadLevel, memcached: psutil.Process):
+        memcached.cpu_affinity(self.policy.memcached[load_level.name])
+        phase = self._phase()
+        background_job = self._current_background_job()
+        if background_job is not None and background_job.name not in self.started:
+            background_job = None
+        assignment = self.policy.assignments.get((phase, load_level.name, background_job is not None))
+        if assignment is None:
+            if phase or background_job is not None:
+                print('No assignment in', self.policy.name, 'for', sorted(phase), load_level.name,
+                    'with' if background_job is not None else 'without', 'background job', flush=True)
+            return
+        for name, cpus in assignment.jobs:
+            JOBS[name].set_cpus(cpus.cpus, cpus.quota)
+        if background_job is None:
+            return
+        if assignment.background is None:
+            if background_job.status() == 'running':
+                background_job.pause()
         else:
-            return LoadLevel.HIGH
+            background_job.set_cpus(assignment.background.cpus, assignment.background.quota)
+            if background_job.status() == 'paused':
+                background_job.unpause()
+
+    def get_new_load_level(self, predicted_qps: float, load_level: LoadLevel, now: Optional[float] = None) -> LoadLevel:
+        return self.controller.get_new_load_level(predicted_qps, load_level, time.monotonic() if now is None else now)
 
-    def print_debug(self):
-        print('Strategy state:  ', self.state, flush=True)
+    def debug_lines(self) -> List[str]:
+        return [f'Policy phase:     {self.policy.name} {sorted(self._phase())}', *self.controller.debug_lines()]
+
+# CPUs left to batch jobs at each load level: whole cores, and the core
+# memcached shares with them together with the batch jobs' share of it
+BATCH_RESERVATION: Dict[LoadLevel, Tuple[List[int], Optional[Tuple[int, float]]]] = {
+    LoadLevel.LOW: ([1, 2, 3], None),
+    LoadLevel.MEDIUM: ([2, 3], (1, 0.25)),
+    LoadLevel.HIGH: ([2, 3], None),
+}
+
+def reallocate_cores(allocator: CoreAllocator, strategy, load_level: LoadLevel):
+    running = [job for job in JOBS.values() if job.status() == 'running']
+    cpus, shared = BATCH_RESERVATION[load_level]
+    allocation = allocator.allocate([(job.name, strategy.get_threads_for_job(job)) for job in running],
+        cpus, shared, {job.name: job.cpus for job in running})
+    for job in running:
+        if job.name in allocation:
+            job.set_cpus(*allocation[job.name])
 
 def predict_qps_from_cpu(cpu_percent: float) -> float:
-    return 585.58444342 * cpu_percent - 822.4653955572503
+    return CPU_LINE[0] * cpu_percent + CPU_LINE[1]
 
 def predict_qps_from_net(net: float) -> float:
-    return 0.99665492 * net - 846.6694402145367
+    return NET_LINE[0] * net + NET_LINE[1]
 
 def get_next_job() -> Optional[Job]:
     for job in JOBS.values():
@@ -260,90 +741,386 @@ def get_next_job() -> Optional[Job]:
             return job
     return None
 
-def write_utilization(data: Iterable[Any]):
-    with open('utilization.csv', 'a', encoding='utf-8') as utilization_file:
-        utilization_file.write(f'{",".join([str(item) for item in data])}\n')
+def record_memcached_cores(recorder: Optional[ColumnarRecorder], memcached: psutil.Process,
+                           last: Optional[List[int]]) -> Optional[List[int]]:
+    if recorder is None:
+        return last
+    cpus = memcached.cpu_affinity()
+    if cpus != last:
+        recorder.write_event(time.time_ns(), 'memcached', 'cores', cpus, len(cpus))
+    return cpus
 
-def run_new_jobs(strategy):
-    for new_job in strategy.get_jobs_to_run():
+def write_latencies(provisioning: Optional[CsvSink], jobs: List[Job], action: str):
+    if provisioning is None or len(jobs) == 0:
+        return
+    latencies = [job.create_latency if action == 'create' else job.start_latency for job in jobs]
+    now = datetime.datetime.now().isoformat()
+    for job, latency in zip(jobs, latencies):
+        provisioning.write([now, job.name, action, f'{latency * 1000:.1f}'])
+    print(f'{action.capitalize()}d {len(jobs)} containers, slowest took {max(latencies) * 1000:.1f} ms', flush=True)
+
+def start_job(strategy, job: Job):
+    job.set_cpus(strategy.get_init_cpuset_for_job(job))
+    job.start()
+
+def run_new_jobs(strategy, provisioning: Optional[CsvSink] = None) -> List[Job]:
+    new_jobs = strategy.get_jobs_to_run()
+    for new_job in new_jobs:
         print('Now running', new_job.name, flush=True)
-        new_job.set_cpus(strategy.get_init_cpuset_for_job(new_job))
-        new_job.start()
+    for_each_job(lambda job: start_job(strategy, job), new_jobs)
+    write_latencies(provisioning, new_jobs, 'start')
+    return new_jobs
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Part 4 memcached/PARSEC co-location scheduler')
+    parser.add_argument('pid', type=int, help='PID of the memcached process')
+    parser.add_argument('--events', action='store_true',
+        help='follow the Docker events stream instead of reloading every container on each tick')
+    parser.add_argument('--sample-period', type=float, default=None, metavar='SECONDS',
+        help='sample telemetry in the background at this period (e.g. 0.05-0.1) instead of blocking for 1s per tick')
+    parser.add_argument('--window', type=float, default=1.0, metavar='SECONDS',
+        help='length of the sample window the decisions are based on when sampling in the background')
+    parser.add_argument('--telemetry', choices=['psutil', 'proc'], default='psutil',
+        help='background sampler backend; proc keeps /proc and cgroup files open and implies --sample-period 0.1')
+    parser.add_argument('--interface', default=None,
+        help='only count packets received on this interface (proc backend), and the NIC moved by --irq-affinity')
+    parser.add_argument('--thread-affinity', action='store_true',
+        help='pin every memcached thread, one worker per core, instead of only the main thread')
+    parser.add_argument('--irq-affinity', action='store_true',
+        help='also move the NIC interrupts and RPS/XPS queues to memcached\'s cores (implies --thread-affinity)')
+    parser.add_argument('--predictor', choices=['static', 'rls', 'ewma'], default='static',
+        help='QPS predictor; rls and ewma refit the offline line online when --calibrate is given')
+    parser.add_argument('--predictor-input', choices=['net', 'cpu'], default='net',
+        help='predict QPS from received packets per second or from memcached CPU usage')
+    parser.add_argument('--calibrate', action='store_true',
+        help='recalibrate the predictor against the request counters from memcached stats')
+    parser.add_argument('--calibrate-interval', type=float, default=1.0, metavar='SECONDS',
+        help='how often to read memcached stats when calibrating')
+    parser.add_argument('--memcached-port', type=int, default=11211)
+    parser.add_argument('--cgroup-writes', action='store_true',
+        help='write cpusets and quotas directly to the containers\' cgroup v2 files instead of going through dockerd')
+    parser.add_argument('--pause-mode', choices=['docker', 'freeze', 'throttle'], default='docker',
+        help='how to stop background jobs at high load: docker pause, writing cgroup.freeze, or lowering cpu.max')
+    parser.add_argument('--throttle-quota', type=float, default=0.05, metavar='CORES',
+        help='CPU quota left to background jobs in throttle mode')
+    parser.add_argument('--policy', default=None, metavar='PATH',
+        help='run a YAML/JSON scheduling policy (see policies/) instead of the built-in Strategy1')
+    parser.add_argument('--allocator', action='store_true',
+        help='redistribute the batch cores by measured per-job scaling instead of the strategy\'s static cpusets')
+    parser.add_argument('--reallocate-interval', type=float, default=5.0, metavar='SECONDS',
+        help='how often the allocator revisits the batch cores')
+    parser.add_argument('--controller', choices=['threshold', 'predictive'], default='threshold',
+        help='load level controller; predictive adds hysteresis, dwell times and a trend forecast')
+    parser.add_argument('--hysteresis', type=float, default=2000,
+        help='QPS below a threshold required before shrinking memcached (predictive controller)')
+    parser.add_argument('--down-dwell', type=float, default=5.0, metavar='SECONDS',
+        help='minimum time at a load level before shrinking memcached (predictive controller)')
+    parser.add_argument('--up-dwell', type=float, default=0.0, metavar='SECONDS',
+        help='minimum time at a load level before growing memcached (predictive controller)')
+    parser.add_argument('--horizon', type=float, default=1.0, metavar='SECONDS',
+        help='how far ahead the QPS trend is extrapolated (predictive controller)')
+    parser.add_argument('--slo-feed', default=None, metavar='file:PATH|tcp:[HOST:]PORT',
+        help='tail the measuring client\'s mcperf output and use its p95 latency in the load level decision')
+    parser.add_argument('--slo-target', type=float, default=1000.0, metavar='US',
+        help='p95 latency SLO in microseconds')
+    parser.add_argument('--slo-tighten', type=float, default=0.8,
+        help='fraction of the SLO at which memcached gets at least one more load level')
+    parser.add_argument('--slo-release', type=float, default=0.5,
+        help='fraction of the SLO below which the QPS controller alone decides again')
+    parser.add_argument('--record', default=None, metavar='DIR',
+        help='also write a binary columnar recording (see recorder.load_recording) of utilization and job events')
+    parser.add_argument('--status-interval', type=float, default=0.0, metavar='SECONDS',
+        help='print the scheduler status at most this often (default: every tick)')
+    parser.add_argument('--no-status', action='store_true', help='never print the per-tick scheduler status')
+    parser.add_argument('--flush-rows', type=int, default=256,
+        help='buffer this many utilization rows before writing them out')
+    parser.add_argument('--flush-interval', type=float, default=5.0, metavar='SECONDS',
+        help='write out buffered utilization rows at least this often')
+    args = parser.parse_args()
+    if args.telemetry == 'proc' and args.sample_period is None:
+        args.sample_period = 0.1
+    return args
 
 if __name__ == '__main__':
-    memcached = psutil.Process(int(sys.argv[1]))
+    args = parse_args()
+    memcached = psutil.Process(args.pid)
     client = docker.from_env()
     load_level = LoadLevel.LOW
     last_net_counter = psutil.net_io_counters().packets_recv
-    strategy = Strategy1()
+    predictor = make_predictor(args.predictor, args.predictor_input)
+    stats: Optional[MemcachedStats] = None
+    # None until a stats read succeeds, the next refit measures from there
+    last_requests: Optional[int] = None
+    last_stats_time = time.monotonic()
+    if args.calibrate:
+        stats = MemcachedStats(port=args.memcached_port)
+        try:
+            last_requests = stats.requests()
+        except OSError as error:
+            print('Reading memcached stats failed:', error, flush=True)
+        last_stats_time = time.monotonic()
+    controller = ThresholdController()
+    if args.controller == 'predictive':
+        transitions = CsvSink('load_levels.csv', args.flush_rows, args.flush_interval)
+        transitions.write(['time', 'from', 'to', 'qps', 'forecast', 'reaction', 'flaps'])
+        close_on_exit(transitions)
+        controller = PredictiveController(hysteresis=args.hysteresis, up_dwell=args.up_dwell,
+            down_dwell=args.down_dwell, horizon=args.horizon, transitions=transitions)
+    feed: Optional[LatencyFeed] = None
+    if args.slo_feed is not None:
+        feed = open_feed(args.slo_feed)
+        feed.start()
+        controller = SloFeedbackController(controller, feed, args.slo_target, args.slo_tighten, args.slo_release)
+    strategy = Strategy1(controller) if args.policy is None else \
+        PolicyStrategy(load_policy(args.policy, JOBS.keys()), controller)
     os.makedirs('logs', exist_ok=True)
-    write_utilization(['time', 'cpu0', 'cpu1', 'cpu2', 'cpu3', 'mcpu', 'mem',
+    utilization = CsvSink('utilization.csv', args.flush_rows, args.flush_interval)
+    jobs_file = CsvSink('jobs.csv', args.flush_rows, args.flush_interval)
+    provisioning = CsvSink('provisioning.csv', args.flush_rows, args.flush_interval)
+    close_on_exit(utilization, jobs_file, provisioning)
+    utilization.write(['time', 'cpu0', 'cpu1', 'cpu2', 'cpu3', 'mcpu', 'mem',
         'qps', 'jobs0', 'jobs1', 'jobs2', 'jobs3'])
-    for job in JOBS.values():
-        job.create(client, strategy.get_threads_for_job(job))
+    provisioning.write(['time', 'job', 'action', 'latency_ms'])
+    Job.pause_mode = args.pause_mode
+    Job.throttle_quota = args.throttle_quota
+    Job.pause_log = CsvSink('pauses.csv', args.flush_rows, args.flush_interval)
+    close_on_exit(Job.pause_log)
+    Job.pause_log.write(['time', 'job', 'action', 'mode', 'latency_ms', 'paused_s', 'lost_core_s'])
+    recorder: Optional[ColumnarRecorder] = None
+    memcached_cpus: Optional[List[int]] = None
+    if args.record is not None:
+        recorder = ColumnarRecorder(args.record, ['memcached', *JOBS.keys()], args.flush_rows, args.flush_interval)
+        close_on_exit(recorder)
+        Job.recorder = recorder
+    for_each_job(lambda job: job.create(client, strategy.get_threads_for_job(job),
+        strategy.get_init_cpuset_for_job(job)), JOBS.values())
+    write_latencies(provisioning, list(JOBS.values()), 'create')
+    # Set by the background sampler and the event stream, whichever is enabled
+    wakeup = threading.Event()
+    events: Optional[ContainerEvents] = None
+    if args.events:
+        events = ContainerEvents(client, JOBS.values(), wakeup)
+        events.start()
+    sampler: Optional[Sampler] = None
+    if args.sample_period is not None:
+        backend = ProcBackend(args.pid, args.interface) if args.telemetry == 'proc' else PsutilBackend(args.pid)
+        sampler = Sampler(backend, args.sample_period, max(10.0, 2 * args.window), wakeup)
+        sampler.start()
+    allocator: Optional[CoreAllocator] = None
+    if args.cgroup_writes:
+        if is_cgroup_v2():
+            Job.cgroup_writes = True
+        else:
+            print('Not on cgroup v2, updating cpusets through dockerd', flush=True)
+    if args.allocator:
+        allocator = CoreAllocator()
+        last_reallocation = time.monotonic()
+    # What the strategies move between load levels: just the memcached
+    # process, or its threads together with the NIC's packet processing
+    placement = memcached
+    if args.thread_affinity or args.irq_affinity:
+        affinity_log = CsvSink('affinity.csv', args.flush_rows, args.flush_interval)
+        close_on_exit(affinity_log)
+        affinity_log.write(['time', 'cpus', 'workers', 'irqs', 'rps', 'xps', 'errors'])
+        placement = NetworkAffinity(args.pid, args.interface, args.irq_affinity, affinity_log)
 
-    run_new_jobs(strategy)
-    strategy.update_load_level(load_level, memcached)
+    with batched_updates():
+        for job in run_new_jobs(strategy, provisioning):
+            if sampler is not None:
+                sampler.backend.add_container(job.name, job.container.id)
+        strategy.update_load_level(load_level, placement)
+    memcached_cpus = record_memcached_cores(recorder, memcached, memcached_cpus)
     start_time = datetime.datetime.now()
     last_time = start_time
+    last_status_time: Optional[datetime.datetime] = None
+    # When the last tick ran, and the end of the last sample window
+    last_tick = time.monotonic()
+    last_window_end: Optional[float] = None
+    # End of the first sample window whose prediction crossed into another
+    # load level, while the level has not followed yet
+    crossed_at: Optional[float] = None
 
     while True:
         # Obtain environment data
-        memcached_cpu_percent = max([memcached.cpu_percent(0.25) for i in range(4)])
-        cpu0_percent, cpu1_percent, cpu2_percent, cpu3_percent = psutil.cpu_percent(percpu=True)
-        memory_percent = psutil.virtual_memory().percent
-        net_counter = psutil.net_io_counters().packets_recv
-        now = datetime.datetime.now()
-        elapsed_time_since_last_check = now - last_time
-        elapsed_time_since_start = now - start_time
-        last_time = now
-        received_packets_per_second = (net_counter - last_net_counter) / elapsed_time_since_last_check.total_seconds()
-        last_net_counter = net_counter
-        predicted_qps = predict_qps_from_net(received_packets_per_second)
-
-        # Print scheduler status
-        print('===============================================================')
-        print(f'CPU%:             {cpu0_percent:.2f} {cpu1_percent:.2f} {cpu2_percent:.2f} {cpu3_percent:.2f}', flush=True)
-        print(f'Memcached CPU%:   {memcached_cpu_percent:.2f}', flush=True)
-        print(f'Received packets: {received_packets_per_second}')
-        print(f'MEM%:             {memory_percent:.2f}', flush=True)
-        print(f'Predicted QPS:    {predicted_qps:.2f}', flush=True)
-        print('Load level:      ', load_level, flush=True)
-        print('Elapsed time:    ', elapsed_time_since_start, flush=True)
-        strategy.print_debug()
-        print('Containers:', flush=True)
-        cpus: List[List[str]] = [[], [], [], []]
-        for job in JOBS.values():
-            job.update()
-            print(f'    {job.name}\t{job.status()}\t{job.runtime():.2f}\t{job.get_cpus()}', flush=True)
-            for cpu in job.get_cpus():
-                cpus[cpu].append(job.name)
-
-        # Write utilization data to file
-        write_utilization([now.isoformat(), cpu0_percent, cpu1_percent,
-            cpu2_percent, cpu3_percent, memcached_cpu_percent, memory_percent,
-            predicted_qps, *['|'.join(cpu) for cpu in cpus]])
-
-        # Shrink and grow memcached based on the current load
-        new_load_level = strategy.get_new_load_level(predicted_qps, load_level)
-        if load_level != new_load_level:
-            print('Updating load level from', load_level, 'to', new_load_level, flush=True)
-            strategy.update_load_level(new_load_level, memcached)
-            load_level = new_load_level
-
-        any_job_finished = False
-        for job in JOBS.values():
-            if job.status() == 'exited' and not job.finished:
-                print('Job', job.name, 'exited', flush=True)
-                job.finished = True
-                any_job_finished = True
-        if any_job_finished:
-            run_new_jobs(strategy)
-            strategy.update_load_level(load_level, memcached)
+        if sampler is not None:
+            # Wake up on every new sample (or container state change) and
+            # read the latest window without blocking on the measurements
+            wakeup.wait(1.0)
+            wakeup.clear()
+            window = sampler.window(args.window)
+            # A container event alone brings no new sample to decide on
+            measured = window.end != last_window_end
+            last_window_end = window.end
+        elif events is None:
+            measured = True
+        else:
+            # Sleep until the tick ends or a container changes state. Usage is
+            # only measured over whole ticks: the few milliseconds after an
+            # event, often one this loop caused, are mostly noise
+            wakeup.wait(max(0.0, 1.0 - (time.monotonic() - last_tick)))
+            wakeup.clear()
+            measured = time.monotonic() - last_tick >= 1.0
+        if measured:
+            if sampler is not None:
+                cpu0_percent, cpu1_percent, cpu2_percent, cpu3_percent = window.cpu_percents
+                memcached_cpu_percent = window.memcached_cpu_percent
+                memory_percent = window.memory_percent
+                received_packets_per_second = window.packets_per_second
+                now = datetime.datetime.now()
+            else:
+                if events is None:
+                    memcached_cpu_percent = max([memcached.cpu_percent(0.25) for i in range(4)])
+                else:
+                    # Over the whole tick since the last measurement
+                    memcached_cpu_percent = memcached.cpu_percent(None)
+                cpu0_percent, cpu1_percent, cpu2_percent, cpu3_percent = psutil.cpu_percent(percpu=True)
+                memory_percent = psutil.virtual_memory().percent
+                net_counter = psutil.net_io_counters().packets_recv
+                now = datetime.datetime.now()
+                received_packets_per_second = (net_counter - last_net_counter) / (now - last_time).total_seconds()
+                last_net_counter = net_counter
+            elapsed_time_since_start = now - start_time
+            last_time = now
+            predictor_input = received_packets_per_second if args.predictor_input == 'net' else memcached_cpu_percent
+            predicted_qps = predictor.predict(predictor_input)
+
+            # Refit the predictor against the QPS memcached actually served
+            if stats is not None and time.monotonic() - last_stats_time >= args.calibrate_interval:
+                try:
+                    requests: Optional[int] = stats.requests()
+                except OSError as error:
+                    # memcached was too busy to answer in time; skip this refit
+                    # and measure the next one from the next successful read
+                    print('Reading memcached stats failed:', error, flush=True)
+                    requests = None
+                stats_time = time.monotonic()
+                if requests is not None and last_requests is not None:
+                    actual_qps = (requests - last_requests) / (stats_time - last_stats_time)
+                    if sampler is not None:
+                        # Use the input over exactly the same interval as the label
+                        calibration_window = sampler.window(stats_time - last_stats_time)
+                        calibration_input = (calibration_window.packets_per_second if args.predictor_input == 'net'
+                            else calibration_window.memcached_cpu_percent)
+                    else:
+                        calibration_input = predictor_input
+                    if actual_qps > 0:
+                        predictor.update(calibration_input, actual_qps)
+                last_requests = requests
+                last_stats_time = stats_time
+
+        # Load levels follow every sample, but reloading the containers that
+        # have no event stream, the status and the utilization log stay on
+        # the 1 s tick
+        ticked = measured if sampler is None else time.monotonic() - last_tick >= 1.0
+        if ticked:
+            tick_seconds = time.monotonic() - last_tick
+            last_tick = time.monotonic()
+
+            # Print scheduler status, collected into a single write
+            print_status = not args.no_status and (last_status_time is None or
+                (now - last_status_time).total_seconds() >= args.status_interval)
+            status: List[str] = []
+            if print_status:
+                last_status_time = now
+                status += [
+                    '===============================================================',
+                    f'CPU%:             {cpu0_percent:.2f} {cpu1_percent:.2f} {cpu2_percent:.2f} {cpu3_percent:.2f}',
+                    f'Memcached CPU%:   {memcached_cpu_percent:.2f}',
+                    f'Received packets: {received_packets_per_second}',
+                    f'MEM%:             {memory_percent:.2f}',
+                    f'Predicted QPS:    {predicted_qps:.2f}',
+                    f'Predictor:        {predictor.coefficients()[0]:.6f} * {args.predictor_input} + {predictor.coefficients()[1]:.2f}',
+                ]
+                if sampler is not None:
+                    status.append(f'Sample age:       {(time.monotonic() - window.end) * 1000:.1f} ms')
+                status += [
+                    f'Load level:       {load_level}',
+                    f'Elapsed time:     {elapsed_time_since_start}',
+                    *strategy.debug_lines(),
+                    'Containers:',
+                ]
+            cpus: List[List[str]] = [[], [], [], []]
+            for job in JOBS.values():
+                job.update()
+                if print_status:
+                    status.append(f'    {job.name}\t{job.status()}\t{job.runtime():.2f}\t{job.get_cpus()}')
+                for cpu in job.get_cpus():
+                    cpus[cpu].append(job.name)
+            if print_status:
+                print('\n'.join(status), flush=True)
+
+            # Buffer utilization data, written out in batches
+            utilization.write([now.isoformat(), cpu0_percent, cpu1_percent,
+                cpu2_percent, cpu3_percent, memcached_cpu_percent, memory_percent,
+                predicted_qps, *['|'.join(cpu) for cpu in cpus]])
+            if recorder is not None:
+                recorder.write_utilization(time.time_ns(), [cpu0_percent, cpu1_percent, cpu2_percent, cpu3_percent],
+                    memcached_cpu_percent, memory_percent, predicted_qps, cpus, load_level)
+
+            # Learn how well each batch job scales from its cgroup CPU usage
+            if allocator is not None:
+                latest = sampler.latest() if sampler is not None else None
+                for job in JOBS.values():
+                    if job.status() == 'running':
+                        used = window.container_cpu_percents.get(job.name, 0.0) / 100 if sampler is not None else 0.0
+                        allocator.observe(job.name, job.quota, used, tick_seconds,
+                            latest.containers.get(job.name) if latest is not None else None)
+
+        # Collect every cpuset change of this tick, unchanged ones are
+        # skipped and the rest are applied together at the end
+        with batched_updates():
+            level_changed = False
+            if measured:
+                if strategy.controller.level_for(predicted_qps) == load_level:
+                    crossed_at = None
+                elif crossed_at is None:
+                    crossed_at = window.end if sampler is not None else time.monotonic()
+                # Shrink and grow memcached based on the current load
+                new_load_level = strategy.get_new_load_level(predicted_qps, load_level)
+                level_changed = load_level != new_load_level
+                if level_changed:
+                    print('Updating load level from', load_level, 'to', new_load_level, flush=True)
+                    strategy.update_load_level(new_load_level, placement)
+                    load_level = new_load_level
+
+            any_job_finished = False
+            for job in JOBS.values():
+                if job.status() == 'exited' and not job.finished:
+                    print('Job', job.name, 'exited', flush=True)
+                    job.finished = True
+                    job.record('end', int(job.end_time().replace(tzinfo=datetime.timezone.utc).timestamp() * 1e9))
+                    any_job_finished = True
+            if any_job_finished:
+                for job in run_new_jobs(strategy, provisioning):
+                    if sampler is not None:
+                        sampler.backend.add_container(job.name, job.container.id)
+                strategy.update_load_level(load_level, placement)
+
+            # Hand the batch cores to whichever jobs gain the most from them
+            if allocator is not None and (level_changed or any_job_finished or
+                    time.monotonic() - last_reallocation >= args.reallocate_interval):
+                reallocate_cores(allocator, strategy, load_level)
+                last_reallocation = time.monotonic()
+        if level_changed or any_job_finished:
+            memcached_cpus = record_memcached_cores(recorder, memcached, memcached_cpus)
+        if level_changed and sampler is not None:
+            # Time from the first sample past the threshold until the change was applied
+            reaction_start = crossed_at if crossed_at is not None else window.end
+            print(f'Reacted to load change in {(time.monotonic() - reaction_start) * 1000:.1f} ms', flush=True)
+        if level_changed:
+            crossed_at = None
 
         if len([job for job in JOBS.values() if job.status() != 'exited']) == 0:
             print('No more jobs to run!', flush=True)
             for job in JOBS.values():
-                job.finish()
-            memcached.cpu_affinity([0, 1])
+                job.finish(jobs_file)
+            placement.cpu_affinity([0, 1])
+            if events is not None:
+                events.close()
+            if feed is not None:
+                feed.close()
+            if sampler is not None:
+                sampler.stop()
+                if isinstance(sampler.backend, ProcBackend):
+                    sampler.backend.close()
             sys.exit(0)
@@ -4,11 +4,10 @@ path = "measurements"
 # iterate through the files in path
 for filename in os.listdir(path):
     if filename.startswith("mcperf"):
-        # remove all lines that don't start with read
-        with open(f"{path}/{filename}", "r") as file:
-            lines = file.readlines()
-
-        with open(f"{path}/{filename}", "w") as file:
-            for line in lines:
+        # remove all lines that don't start with read, streaming into a copy
+        # that replaces the original once complete
+        with open(f"{path}/{filename}", "r") as file, open(f"{path}/{filename}.tmp", "w") as cleaned:
+            for line in file:
                 if line.startswith("read") or line.startswith("#type"):
-                    file.write(line)
+                    cleaned.write(line)
+        os.replace(f"{path}/{filename}.tmp", f"{path}/{filename}")
@@ -1,22 +1,29 @@
+import concurrent.futures
+import os
+import sys
 import pandas as pd
 from termcolor import colored
 import matplotlib.pyplot as plt
 import numpy as np
 from sklearn.linear_model import LinearRegression
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mcperf_parser import McperfFile
 
 
 def load_cpu_data(path):
-    df = pd.read_csv(path, header=None, delim_whitespace=True)
+    # monitor.py --pid output starts with these columns, per-CPU ones follow
+    df = pd.read_csv(path, header=None, delim_whitespace=True, comment="#", usecols=range(4))
     df.columns = ["timestamp", "mem", "cpu0", "packets_recv"]  # "mem", "cpu2", "cpu3"]
-    # turn mem, cpu0, cpu1, cpu2, cpu3 columns into float
+    # turn mem, cpu0, cpu1, cpu2, cpu3 columns into float, older runs have % signs
     for col in df.columns[1:-1]:
-        df[col] = df[col].str.replace("%", "").astype(float)
+        df[col] = df[col].astype(str).str.replace("%", "").astype(float)
     # print(df.head())
     return df
 
 
 def load_qps_data(path):
-    df = pd.read_csv(path, delim_whitespace=True)
+    # raw mcperf output works too, extra header lines are skipped
+    df = pd.DataFrame(McperfFile(path).arrays())
     df["ts_start"] /= 1000
     df["ts_end"] /= 1000
     # print(df.head())
@@ -24,33 +31,53 @@ def load_qps_data(path):
 
 
 def join_cpu_df(cpu_df, qps_df):
-    # For each row of cpu_df, find the corresponding row in qps_df and add it to that cpu_df row
-    for index, cpu_row in cpu_df.iterrows():
-        ts = cpu_row["timestamp"]
-        qps_row = qps_df[(qps_df["ts_start"] <= ts) & (qps_df["ts_end"] >= ts)]
-
-        if len(qps_row) > 1:
-            print(colored(f"More than one QPS data found for timestamp {ts}", "yellow"))
-        elif not qps_row.empty:
-            cpu_df.at[index, "QPS"] = qps_row["QPS"].values[0]
-            cpu_df.at[index, "target"] = qps_row["target"].values[0]
-            cpu_df.at[index, "ts_start"] = qps_row["ts_start"].values[0]
-            cpu_df.at[index, "ts_end"] = qps_row["ts_end"].values[0]
+    # Interval join on sorted buckets: each cpu_df row gets the QPS bucket with
+    # ts_start <= timestamp <= ts_end, rows with no or more than one bucket are dropped
+    buckets = qps_df.sort_values("ts_start", kind="stable").reset_index(drop=True)
+    starts = buckets["ts_start"].to_numpy()
+    ends = buckets["ts_end"].to_numpy()
+    ts = cpu_df["timestamp"].to_numpy()
+
+    # buckets started by ts minus buckets already over by ts = buckets containing ts
+    started = np.searchsorted(starts, ts, side="right")
+    matches = started - np.searchsorted(np.sort(ends), ts, side="left")
+    bucket = np.where(matches == 1, started - 1, -1)
+    # with nested buckets the last one to start may already be over
+    for i in np.flatnonzero((bucket >= 0) & (ends[np.maximum(bucket, 0)] < ts)):
+        bucket[i] = np.flatnonzero((starts <= ts[i]) & (ends >= ts[i]))[0]
+
+    ambiguous = matches > 1
+    if ambiguous.any():
+        print(colored(f"More than one QPS data found for {ambiguous.sum()} timestamps "
+                      f"between {ts[ambiguous].min()} and {ts[ambiguous].max()}", "yellow"))
+    overlapping = np.flatnonzero(starts[1:] <= ends[:-1])
+    if len(overlapping) > 0:
+        print(colored(f"{len(overlapping)} QPS buckets overlap the next one, first at "
+                      f"ts_start {starts[overlapping[0]]}", "yellow"))
+
+    matched = bucket >= 0
+    cpu_df = cpu_df.copy()
+    for column in ["QPS", "target", "ts_start", "ts_end"]:
+        values = np.full(len(cpu_df), np.nan)
+        values[matched] = buckets[column].to_numpy()[bucket[matched]]
+        cpu_df[column] = values
 
     # drow rows with Nan values
     cpu_df = cpu_df.dropna()
     return cpu_df
 
 
-def load_all_data(cpu_paths, qps_paths):
-    dfs = []
-    for i, (cpu_path, qps_path) in enumerate(zip(cpu_paths, qps_paths)):
-        cpu_df = load_cpu_data(cpu_path)
-        qps_df = load_qps_data(qps_path)
-        df = join_cpu_df(cpu_df, qps_df)
+def load_run(paths):
+    cpu_path, qps_path = paths
+    return join_cpu_df(load_cpu_data(cpu_path), load_qps_data(qps_path))
+
 
+def load_all_data(cpu_paths, qps_paths):
+    # runs are independent, load and join them in parallel
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        dfs = list(executor.map(load_run, zip(cpu_paths, qps_paths)))
+    for i, df in enumerate(dfs):
         df["run"] = i
-        dfs.append(df)
 
     # concatenate all dataframes
     df = pd.concat(dfs)
@@ -140,27 +167,28 @@ def predict_qps_from_net(net):
     return 0.99665492 * net - 846.6694402145367
 
 
-# cpu_paths = [
-#     "measurements/performance-c2-t2-1.txt",
-#     "measurements/performance-c2-t2-2.txt",
-#     "measurements/performance-c2-t2-3.txt",
-# ]
-# qps_paths = [
-#     "measurements/mcperf-c2-t2-1.txt",
-#     "measurements/mcperf-c2-t2-2.txt",
-#     "measurements/mcperf-c2-t2-3.txt",
-# ]
-
-cpu_paths = ["measurements/performance-c2-t2-0.txt"]
-qps_paths = ["measurements/mcperf-c2-t2-0.txt"]
-
-df = load_all_data(cpu_paths, qps_paths)
-df["time_delta"] = df["timestamp"] - df["ts_start"]
-print(colored("All data loaded", "green"))
-print(df.head())
-
-# plot_cpu_qps(df)
-# plot_net_qps(df)
-# plot_relative_cpu_time_delta(df)
-# get_line_cpu(df)
-get_line_net(df)
+if __name__ == "__main__":
+    # cpu_paths = [
+    #     "measurements/performance-c2-t2-1.txt",
+    #     "measurements/performance-c2-t2-2.txt",
+    #     "measurements/performance-c2-t2-3.txt",
+    # ]
+    # qps_paths = [
+    #     "measurements/mcperf-c2-t2-1.txt",
+    #     "measurements/mcperf-c2-t2-2.txt",
+    #     "measurements/mcperf-c2-t2-3.txt",
+    # ]
+
+    cpu_paths = ["measurements/performance-c2-t2-0.txt"]
+    qps_paths = ["measurements/mcperf-c2-t2-0.txt"]
+
+    df = load_all_data(cpu_paths, qps_paths)
+    df["time_delta"] = df["timestamp"] - df["ts_start"]
+    print(colored("All data loaded", "green"))
+    print(df.head())
+
+    # plot_cpu_qps(df)
+    # plot_net_qps(df)
+    # plot_relative_cpu_time_delta(df)
+    # get_line_cpu(df)
+    get_line_net(df)
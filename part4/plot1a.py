@@ -1,17 +1,18 @@
+import os
+import sys
 from typing import List, Tuple
 from matplotlib import pyplot as plt
 import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mcperf_parser import McperfFile
 
 def read_measurements(filename: str) -> Tuple[List[float], List[float]]:
-    with open(filename, 'r', encoding='utf-8') as file:
-        qps: List[float] = []
-        p95: List[float] = []
-        for line in file:
-            if line.startswith('read'):
-                reading = line.split()
-                qps.append(float(reading[16]) / 1000)
-                p95.append(float(reading[12]) / 1000)
-        return qps, p95
+    qps: List[float] = []
+    p95: List[float] = []
+    for row in McperfFile(filename).rows():
+        qps.append(row.qps / 1000)
+        p95.append(row.p95 / 1000)
+    return qps, p95
 
 plt.figure(figsize=(10, 6))
 T = [1, 2]
@@ -1,82 +1,89 @@
-from typing import List, Tuple
+import os
+import sys
+from typing import Dict, List, Tuple
 from matplotlib import pyplot as plt
 import numpy as np
 from labellines import labelLine, labelLines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mcperf_parser import McperfFile
 
 def read_measurements(filename: str) -> Tuple[List[float], List[float]]:
-    with open(filename, 'r', encoding='utf-8') as file:
-        qps: List[float] = []
-        p95: List[float] = []
-        start_times: List[float] = []
-        end_times: List[float] = []
-        for line in file:
-            if line.startswith('read'):
-                reading = line.split()
-                qps.append(float(reading[16]) / 1000)
-                p95.append(float(reading[12]) / 1000)
-                start_times.append(float(reading[18][:10]))
-                end_times.append(float(reading[19][:10]))
-        return qps, p95, start_times, end_times
+    qps: List[float] = []
+    p95: List[float] = []
+    start_times: List[float] = []
+    end_times: List[float] = []
+    for row in McperfFile(filename).rows():
+        qps.append(row.qps / 1000)
+        p95.append(row.p95 / 1000)
+        # Whole seconds of the measurement window
+        start_times.append(float(row.ts_start // 1000))
+        end_times.append(float(row.ts_end // 1000))
+    return qps, p95, start_times, end_times
     
-def read_cpu_utilization(filename: str) -> List[float]:
-    cpu_info = {
-        'c1': [],
-        'time': [],
-    }
+def read_cpu_utilization(filename: str) -> Dict[str, np.ndarray]:
+    # Timestamp, memory and CPU columns of performance_memcached.py's output,
+    # with or without the % signs; timestamps in whole seconds
     with open(filename, 'r', encoding='utf-8') as file:
-        for line in file:
-            reading = line.split()
-            cpu_info['c1'].append(float(reading[2][:-1]))
-            cpu_info['time'].append(float(reading[0].split('.')[0]))
-        return cpu_info
+        table = np.loadtxt((line.replace('%', '') for line in file), usecols=(0, 2), ndmin=2)
+    return {
+        'c1': table[:, 1],
+        'time': np.floor(table[:, 0]),
+    }
+
+def grouped_median(groups: np.ndarray, values: np.ndarray, count: int) -> np.ndarray:
+    # Median of the values in each of count groups, NaN for empty groups
+    values = values[np.lexsort((values, groups))]
+    sizes = np.bincount(groups, minlength=count)
+    offsets = np.cumsum(sizes) - sizes
+    medians = np.full(count, np.nan)
+    present = sizes > 0
+    lower = (offsets + (sizes - 1) // 2)[present]
+    upper = (offsets + sizes // 2)[present]
+    medians[present] = (values[lower] + values[upper]) / 2
+    return medians
 
 def get_cpu_utilization(start_times, end_times, qpss, cpu_info):
-    # take buckets of qps times
-    qps_to_cpu = {}
-    qps_to_cpu_median = {}
-    for i in range(len(qpss)):
-        start_time = start_times[i]
-        end_time = end_times[i]
-        cpu_utilization_curr = []
-        for j in range(len(cpu_info['time'])):
-            if start_time <= cpu_info['time'][j] <= end_time:
-                cpu_utilization_curr.append(cpu_info['c1'][j])
-        cpu_utilization_median = np.median(cpu_utilization_curr)
-        qps_to_cpu[qpss[i]] = cpu_utilization_curr
-        qps_to_cpu_median[qpss[i]] = cpu_utilization_median
+    # Every sample within [start, end] of a QPS bucket belongs to it; the
+    # bucket edges are found by binary search over the sorted samples
+    order = np.argsort(cpu_info['time'], kind='stable')
+    times = cpu_info['time'][order]
+    cpus = cpu_info['c1'][order]
+    first = np.searchsorted(times, start_times, side='left')
+    counts = np.maximum(np.searchsorted(times, end_times, side='right') - first, 0)
+    buckets = np.repeat(np.arange(len(qpss)), counts)
+    samples = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    cpu_utilization = cpus[samples]
+    cpu_medians = grouped_median(buckets, cpu_utilization, len(qpss))
 
-    res = []
-    for q in qpss[:-2]:
-        for c in qps_to_cpu[q]:
-            res.append([q, c])
-    res = np.array(res)
+    # The last two buckets are left out
+    kept = buckets < len(qpss) - 2
+    res = np.column_stack((np.asarray(qpss)[buckets[kept]], cpu_utilization[kept]))
+    return res, cpu_medians[:len(qpss) - 2]
 
-    cpu_medians = []
-    for q in qpss[:-2]:
-        cpu_medians.append(qps_to_cpu_median[q])
-    return res, np.array(cpu_medians)
+def load_configuration(cores: int, threads: int, runs: int = 3):
+    # Means over all repetitions of one configuration
+    qpss = []
+    p95s = []
+    cpu_utilizations = []
+    for i in range(1, runs + 1):
+        measurement_filename = f'measurements/mcperf-c{cores}-t{threads}-{i}.txt'
+        qps, p95, start_times, end_times = read_measurements(measurement_filename)
+        performance_filename = f'measurements/performance-c{cores}-t{threads}-{i}.txt'
+        cpu_info = read_cpu_utilization(performance_filename)
+        cpu_utilization, cpu_median = get_cpu_utilization(start_times, end_times, qps, cpu_info)
+        cpu_utilizations.append(cpu_median)
+        qpss.append(qps)
+        p95s.append(p95)
+    return (np.mean(np.array(qpss), axis=0), np.mean(np.array(p95s), axis=0),
+            np.mean(np.array(cpu_utilizations), axis=0))
 
 fig, (ax1, ax3) = plt.subplots(1, 2, figsize=(12, 6))
 
-# ======================== First plot ========================
-# read measurements
-qpss = []
-p95s = []
-cpu_utilizations = []
-qps_for_cpu = []
-for i in range(1, 4):
-    measurement_filename = f'measurements/mcperf-c1-t2-{i}.txt'
-    qps, p95, start_times, end_times = read_measurements(measurement_filename)
-    performance_filename = f'measurements/performance-c1-t2-{i}.txt'
-    cpu_info = read_cpu_utilization(performance_filename)
-    cpu_utilization, cpu_median = get_cpu_utilization(start_times, end_times, qps, cpu_info)
-    cpu_utilizations.append(cpu_median)
-    qpss.append(qps)
-    p95s.append(p95)
+# read measurements of every configuration up front
+results = {(cores, threads): load_configuration(cores, threads) for cores, threads in [(1, 2), (2, 2)]}
 
-qps_mean = np.mean(np.array(qpss), axis=0)
-p95_mean = np.mean(np.array(p95s), axis=0)
-cpu_utilizations = np.mean(np.array(cpu_utilizations), axis=0)
+# ======================== First plot ========================
+qps_mean, p95_mean, cpu_utilizations = results[(1, 2)]
 
 # x-axis
 plt.xlim(0, 130)
@@ -105,24 +112,7 @@ labelLines(ax2.get_lines(), align=False, fontsize=12)
 ax1.legend(loc='upper left')
 ax2.legend(loc='upper right')
 # ======================== Second plot ========================
-# read measurements
-qpss = []
-p95s = []
-cpu_utilizations = []
-qps_for_cpu = []
-for i in range(1, 4):
-    measurement_filename = f'measurements/mcperf-c2-t2-{i}.txt'
-    qps, p95, start_times, end_times = read_measurements(measurement_filename)
-    performance_filename = f'measurements/performance-c2-t2-{i}.txt'
-    cpu_info = read_cpu_utilization(performance_filename)
-    cpu_utilization, cpu_median = get_cpu_utilization(start_times, end_times, qps, cpu_info)
-    cpu_utilizations.append(cpu_median)
-    qpss.append(qps)
-    p95s.append(p95)
-
-qps_mean = np.mean(np.array(qpss), axis=0)
-p95_mean = np.mean(np.array(p95s), axis=0)
-cpu_utilizations = np.mean(np.array(cpu_utilizations), axis=0)
+qps_mean, p95_mean, cpu_utilizations = results[(2, 2)]
 
 # x-axis
 plt.xlim(0, 130)
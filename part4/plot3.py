@@ -2,127 +2,133 @@ from matplotlib import pyplot as plt
 import numpy as np
 from labellines import labelLine, labelLines
 import json
-from datetime import datetime
 import matplotlib.colors as mcolors
 import pandas as pd
 import time
-
-def time_to_timestamp(time_str):
-    return float(datetime.fromisoformat(time_str).timestamp())
+import os
+import sys
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from recorder import load_recording
+from time_align import from_naive_iso, mcperf_frame, relative_seconds, utilization_frame
+
+JOB_NAMES = ["radix", "blackscholes", "vips", "ferret", "canneal", "dedup", "freqmine"]
+NAME_TO_COLOR = {
+    "blackscholes": "CCA000",
+    "canneal": "CCCCAA",
+    "dedup": "CCACCA",
+    "ferret": "AACCCA",
+    "freqmine": "0CCA00",
+    "radix": "00CCA0",
+    "vips": "CC0A00",
+}
+CORE_COLUMNS = ["jobs0", "jobs1", "jobs2", "jobs3"]
+
+def relative_times(times):
+    # seconds since the first row, all rows parsed at once
+    ns = from_naive_iso(times)
+    return relative_seconds(ns, ns[0])
+
+def job_presence(df, job_names):
+    # rows x jobs, True where any core runs the job; a core may list
+    # several jobs such as radix|dedup
+    cells = ["|" + df[column].fillna("").astype(str) + "|" for column in CORE_COLUMNS if column in df]
+    presence = np.zeros((len(df), len(job_names)), dtype=bool)
+    for j, name in enumerate(job_names):
+        for column in cells:
+            presence[:, j] |= column.str.contains(f"|{name}|", regex=False).to_numpy()
+    return presence
+
+def job_segments(presence, times, job_names=JOB_NAMES):
+    # run-length encode the rows x jobs presence matrix: one row per stretch
+    # of rows a job ran for, with the first and last row it was seen on. A
+    # pause ends the stretch at the first row without the job, the last
+    # stretch ends at the last row with it
+    rows = len(presence)
+    padded = np.zeros((len(job_names), rows + 2), dtype=np.int8)
+    padded[:, 1:-1] = presence.T
+    edges = np.diff(padded, axis=1)
+    jobs, start_idx = np.nonzero(edges == 1)
+    _, end_idx = np.nonzero(edges == -1)
+    end_idx = end_idx - 1
+    is_last = np.append(jobs[1:] != jobs[:-1], True) if len(jobs) else np.zeros(0, dtype=bool)
+    end_row = np.where(is_last, end_idx, np.minimum(end_idx + 1, rows - 1))
+    return pd.DataFrame({
+        "job": np.array(job_names, dtype=object)[jobs],
+        "start_idx": start_idx,
+        "end_idx": end_idx,
+        "start_time": times[start_idx],
+        "end_time": times[end_row],
+    })
+
+def get_job_segments(df, job_names=JOB_NAMES):
+    times = relative_times(df["time"])
+    return job_segments(job_presence(df, job_names), times, job_names), times
 
 def get_job_dict(jobs_path):
     # Read csv file
     df = pd.read_csv(jobs_path, header=0)
-    job_dict = {}
+    return job_dict_from_segments(*get_job_segments(df))
 
-    job_names = ["radix", "blackscholes", "vips", "ferret", "canneal", "dedup", "freqmine"]
-    for name in job_names:
+def job_dict_from_segments(segments, times):
+    durations = (segments["end_time"] - segments["start_time"]).groupby(segments["job"]).sum()
+
+    job_dict = {}
+    for name in JOB_NAMES:
+        job_segments = segments[segments["job"] == name]
         job_dict[name] = {
-            "start_time": None,
-            "end_time": None,
-            "start_idx": None,
-            "end_idx": None,
-            "color": None,
-            "duration": 0,
+            "start_time": job_segments["start_time"].tolist(),
+            "end_time": job_segments["end_time"].tolist(),
+            "start_idx": job_segments["start_idx"].tolist(),
+            "end_idx": job_segments["end_idx"].tolist(),
+            "color": mcolors.hex2color("#" + NAME_TO_COLOR[name]),
+            "duration": float(durations.get(name, 0)),
         }
 
-    name_to_color = {
-        "blackscholes": "CCA000",
-        "canneal": "CCCCAA",
-        "dedup": "CCACCA",
-        "ferret": "AACCCA",
-        "freqmine": "0CCA00",
-        "radix": "00CCA0",
-        "vips": "CC0A00",
-    }
+    total_time = float(times[-1])
+    return job_dict, total_time
 
-    first_timestamp = time_to_timestamp(df["time"][0])
-
-    # find times
-    for name in job_names:
-        job_dict[name]["color"] = name_to_color[name]
-        for i in range(len(df)):
-            if df["jobs1"][i] == name or df["jobs2"][i] == name or df["jobs3"][i] == name:
-                job_dict[name]["start_time"] = [time_to_timestamp(df["time"][i]) - first_timestamp]
-                job_dict[name]["start_idx"] = [i]
-                # find end time
-                for j in range(i, len(df)):
-                    if df["jobs1"][j] == name or df["jobs2"][j] == name or df["jobs3"][j] == name:
-                        job_dict[name]["end_time"] = [time_to_timestamp(df["time"][j]) - first_timestamp]
-                        job_dict[name]["end_idx"] = [j]
-                break
-
-    # print start and end times
-    # for name in job_names:
-    #     print(f"{name}: {job_dict[name]['start_time']} - {job_dict[name]['end_time']}")
-
-    # check for pauses 
-    for name in job_names:
-        i = job_dict[name]["start_idx"][0]
-        end_idx = job_dict[name]["end_idx"][0]
-        total_end_time = time_to_timestamp(df["time"].iloc[end_idx]) - first_timestamp
-        while i < end_idx:
-            if df["jobs1"].iloc[i] != name and df["jobs2"].iloc[i] != name and df["jobs3"].iloc[i] != name:
-                job_dict[name]["end_time"][-1] = time_to_timestamp(df["time"].iloc[i]) - first_timestamp
-                job_dict[name]["end_idx"][-1] = df.index[i - 1]
-                while df["jobs1"].iloc[i] != name and df["jobs2"].iloc[i] != name and df["jobs3"].iloc[i] != name:
-                    i += 1
-                job_dict[name]["start_time"].append(time_to_timestamp(df["time"].iloc[i]) - first_timestamp)
-                job_dict[name]["start_idx"].append(df.index[i])
-                for j in range(i, end_idx):
-                    if df["jobs1"].iloc[j] != name and df["jobs2"].iloc[j] != name and df["jobs3"].iloc[j] != name:
-                        job_dict[name]["end_time"].append(time_to_timestamp(df["time"].iloc[j]) - first_timestamp)
-                        job_dict[name]["end_idx"].append(df.index[j])
-                        break
-            i += 1
-        job_dict[name]["end_time"].append(total_end_time)
-    
-    # # print start and end times
-    # for name in job_names:
-    #     print(f"{name}: {job_dict[name]['start_time']} - {job_dict[name]['end_time']}")
-    rgb_colors = {
-        name: mcolors.hex2color("#" + hex_color)
-        for name, hex_color in name_to_color.items()
-    }
-    for name in rgb_colors:
-        job_dict[name]["color"] = rgb_colors[name]
 
-    total_time = time_to_timestamp(df["time"].iloc[-1]) - first_timestamp
-    return job_dict, total_time
 
+def utilization_columns(run):
+    # epoch ns times, predicted QPS, memcached's cores and the rows x jobs
+    # presence matrix of utilization.csv
+    df = utilization_frame(os.path.join(run, "utilization.csv"))
+    return df["time"].to_numpy(), df["qps"].to_numpy(), np.where(df["jobs1"].notna(), 1, 2).tolist(), \
+        job_presence(df, JOB_NAMES)
 
+def recording_columns(run):
+    # the same from part4.py --record's tables, memory-mapped instead of
+    # parsed; a core runs a job when its bit is set in the core's job mask
+    recording = load_recording(os.path.join(run, RECORDING_DIR))
+    table = recording.utilization
+    masks = np.stack([table[column] for column in CORE_COLUMNS], axis=1)
+    presence = np.zeros((len(table), len(JOB_NAMES)), dtype=bool)
+    for j, name in enumerate(JOB_NAMES):
+        if name in recording.jobs:
+            presence[:, j] = (masks & (1 << recording.jobs.index(name))).any(axis=1)
+    return table["time"].astype(np.int64), table["qps"].astype(np.float64), \
+        np.where(masks[:, 1] != 0, 1, 2).tolist(), presence
 
 def get_jobs_info(jobs_path, mcperf_path):
     # Read csv file
-    df = pd.read_csv(jobs_path, header=0)
-
-    # convert date time to timestamp
-    jobs_timestamps = df["time"]
-    jobs_timestamps = [datetime.fromisoformat(t).timestamp() for t in jobs_timestamps]
-    # convert to int
-    jobs_timestamps = np.array(jobs_timestamps, dtype=int)
-    # rebase to 0
-    jobs_timestamps = jobs_timestamps - jobs_timestamps[0]
-    jobs_qps = df["qps"] / 1000
-    cores = [1 if isinstance(df["jobs1"][i], str) else 2 for i in range(len(df))]
-    qpss = []
-    p95s = []
-
-    # Read mcperf txt
-    with open(mcperf_path, "r") as f:
-        lines = f.readlines()
-        timestamp_start = int(lines[3].split()[-1])
-        timestamp_end = int(lines[4].split()[-1])
-        for line in lines:
-            if line.startswith("read"):
-                reading = line.split()
-                qpss.append(float(reading[16]) / 1000)
-                p95s.append(float(reading[12]) / 1000)
-    
-    # get timestamps from start to end with step of 10s
-    mcperf_timestamps = np.arange(0, timestamp_end - timestamp_start, 4000)
-    # convert timestamps to seconds
-    mcperf_timestamps = mcperf_timestamps / 1000
+    df = utilization_frame(jobs_path)
+    return jobs_info(df["time"].to_numpy(), df["qps"].to_numpy(), np.where(df["jobs1"].notna(), 1, 2).tolist(), mcperf_path)
+
+def jobs_info(times, qps, cores, mcperf_path):
+    # seconds since the first utilization row, which the job segments use too
+    origin = times[0]
+    jobs_timestamps = relative_seconds(times, origin)
+    jobs_qps = qps / 1000
+
+    # Read mcperf txt, each line placed at the start of the interval it measured
+    mcperf = mcperf_frame(mcperf_path)
+    qpss = (mcperf["QPS"] / 1000).tolist()
+    p95s = (mcperf["p95"] / 1000).tolist()
+    mcperf_timestamps = relative_seconds(mcperf["start"], origin)
     return mcperf_timestamps, qpss, p95s, cores, jobs_timestamps, jobs_qps
     
 def plot_A(ax, title, x, y, y2, label, label2):
@@ -211,108 +217,188 @@ def plot_jobs(ax, jobs_dict, plot_type="A"):
                 color=jobs_dict[name]["color"],
             )
 
-def calculate_durations(jobs_dict):
-    for name in jobs_dict:
-        for i in range(len(jobs_dict[name]["start_time"])):
-            job_dict[name]["duration"] += jobs_dict[name]["end_time"][i] - jobs_dict[name]["start_time"][i]
-
 def get_slo_violations(p95s, mcperf_ts, jobs_ts):
     # filter qps after last job
     first_job_start = jobs_ts[0]
     last_job_end = jobs_ts[-1]
-    print(f"Last job end: {last_job_end}")
     new_p95s = [p95 for p95, t in zip(p95s, mcperf_ts) if t <= last_job_end and t >= first_job_start]
     # find violations over 1ms
     violations = [p95 for p95 in new_p95s if p95 > 1]
     # find percentage of violations
-    print(f"Number of latecies: {len(new_p95s)}")
     percentage = len(violations) / len(new_p95s) * 100
-    print(f"Percentage of violations: {percentage}%")
     return percentage, len(violations), len(new_p95s)
 
-if __name__ == "__main__":
-    # plot six plots in one figure with 3 rows and 2 columns
-    fig, axs = plt.subplots(3, 2, figsize=(20, 20))
-
-    # ======================== First row ========================
-    # plot a line with a marker
-    mcperf_ts, mcperf_qps, p95s, cores, jobs_ts, jobs_qps = get_jobs_info("measurements/part44-interval4/utilization.csv", "measurements/part44-interval4/mcperf.txt")
-    plot_A(axs[0, 0], '1A', mcperf_ts[:-1], p95s, mcperf_qps, '95th percentile latency', 'QPS')
-    job_dict, total_time1 = get_job_dict("measurements/part44-interval4/utilization.csv")
-    plot_jobs(axs[0, 0], job_dict)
-    plot_B(axs[0, 1], '1B', jobs_ts[1:], cores[1:], jobs_qps[1:], 'CPU cores', 'QPS')
-    plot_jobs(axs[0, 1], job_dict, plot_type="B")
-    print("============== Run 1 ==============")
-    calculate_durations(job_dict)
-    for name in job_dict:
-        print(f"{name}: {job_dict[name]['duration']}")
-
-    durations = {}
-    for name in job_dict:
-        durations[name] = [job_dict[name]["duration"]]
-   
-    slo_perc, slo_violations, len_p95s = get_slo_violations(p95s, mcperf_ts, jobs_ts)
-    total_slo_violations = slo_violations
-    total_len_p95s = len_p95s
-    # ======================== Second row ========================
-    # plot a bar chart
-    mcperf_ts, mcperf_qps, p95s, cores, jobs_ts, jobs_qps = get_jobs_info("measurements/part44-interval4-2/utilization.csv", "measurements/part44-interval4-2/mcperf.txt")
-    plot_A(axs[1, 0], '2A', mcperf_ts[:-1], p95s, mcperf_qps, '95th percentile latency', 'QPS')
-    job_dict, total_time2 = get_job_dict("measurements/part44-interval4-2/utilization.csv")
-    plot_jobs(axs[1, 0], job_dict)
-    plot_B(axs[1, 1], '2B', jobs_ts[1:], cores[1:], jobs_qps[1:], 'CPU cores', 'QPS')
-    plot_jobs(axs[1, 1], job_dict, plot_type="B")
-
-    print("============== Run 2 ==============")
-    calculate_durations(job_dict)
-    for name in job_dict:
-        print(f"{name}: {job_dict[name]['duration']}")
-        durations[name].append(job_dict[name]["duration"])
-
+# Bump when the summary layout changes so stale cache entries are recomputed
+CACHE_VERSION = 3
+RUN_FILES = ["utilization.csv", "mcperf.txt"]
+# part4.py --record's output, read instead of utilization.csv when a run has it
+RECORDING_DIR = "recording"
+RECORDING_FILES = [os.path.join(RECORDING_DIR, name) for name in ["meta.json", "utilization.bin", "events.bin"]]
+
+def has_recording(run):
+    return os.path.isfile(os.path.join(run, RECORDING_DIR, "meta.json"))
+
+def run_files(run):
+    return ["mcperf.txt"] + [name for name in RECORDING_FILES if os.path.isfile(os.path.join(run, name))] \
+        if has_recording(run) else RUN_FILES
+
+def find_runs(patterns):
+    # every directory matching one of the patterns that holds a complete run
+    runs = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if all(os.path.isfile(os.path.join(path, name)) for name in run_files(path)):
+                runs.add(os.path.abspath(path))
+    return sorted(runs)
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def run_fingerprint(run, cached=None):
+    # files whose mtime and size match the cached entry are trusted without
+    # rehashing, so an unchanged run costs two stat calls
+    fingerprint = {}
+    for name in run_files(run):
+        path = os.path.join(run, name)
+        stat = os.stat(path)
+        entry = (cached or {}).get(name)
+        if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            fingerprint[name] = entry
+        else:
+            fingerprint[name] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": file_hash(path)}
+    return fingerprint
 
+def summarize_run(run):
+    times, qps, cores, presence = recording_columns(run) if has_recording(run) else utilization_columns(run)
+    mcperf_ts, mcperf_qps, p95s, cores, jobs_ts, jobs_qps = jobs_info(times, qps, cores, os.path.join(run, "mcperf.txt"))
+    job_dict, total_time = job_dict_from_segments(job_segments(presence, jobs_ts), jobs_ts)
     slo_perc, slo_violations, len_p95s = get_slo_violations(p95s, mcperf_ts, jobs_ts)
-    total_slo_violations += slo_violations
-    total_len_p95s += len_p95s
-    # ======================== Third row ========================
-    # plot a pie chart
-    mcperf_ts, mcperf_qps, p95s, cores, jobs_ts, jobs_qps = get_jobs_info("measurements/part44-interval4-3/utilization.csv", "measurements/part44-interval4-3/mcperf.txt")
-    plot_A(axs[2, 0], '3A', mcperf_ts[:-1], p95s, mcperf_qps, '95th percentile latency', 'QPS')
-    job_dict, total_time3 = get_job_dict("measurements/part44-interval4-3/utilization.csv")
-    plot_jobs(axs[2, 0], job_dict)
-    plot_B(axs[2, 1], '3B', jobs_ts[1:], cores[1:], jobs_qps[1:], 'CPU cores', 'QPS')
-    plot_jobs(axs[2, 1], job_dict, plot_type="B")
-
-    print("============== Run 3 ==============")
-    calculate_durations(job_dict)
-    for name in job_dict:
-        print(f"{name}: {job_dict[name]['duration']}")
-        durations[name].append(job_dict[name]["duration"])
+    return {
+        "mcperf_ts": mcperf_ts.tolist(),
+        "mcperf_qps": mcperf_qps,
+        "p95s": p95s,
+        "cores": cores,
+        "jobs_ts": jobs_ts.tolist(),
+        "jobs_qps": jobs_qps.tolist(),
+        "jobs": {
+            name: {
+                "start_time": [float(t) for t in job["start_time"]],
+                "end_time": [float(t) for t in job["end_time"]],
+                "color": list(job["color"]),
+                "duration": float(job["duration"]),
+            }
+            for name, job in job_dict.items()
+        },
+        "total_time": total_time,
+        "last_job_end": int(jobs_ts[-1]),
+        "slo_percentage": slo_perc,
+        "slo_violations": slo_violations,
+        "latencies": len_p95s,
+    }
 
-    slo_perc, slo_violations, len_p95s = get_slo_violations(p95s, mcperf_ts, jobs_ts)
-    total_slo_violations += slo_violations
-    total_len_p95s += len_p95s
+def load_summaries(runs, cache_path, workers=None):
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+        if cache.get("version") != CACHE_VERSION:
+            cache = {}
+    entries = cache.get("runs", {})
+
+    summaries = {}
+    stale = []
+    fingerprints = {}
+    for run in runs:
+        entry = entries.get(run, {})
+        fingerprint = run_fingerprint(run, entry.get("files"))
+        fingerprints[run] = fingerprint
+        cached_hashes = {name: file["sha1"] for name, file in entry.get("files", {}).items()}
+        if "summary" in entry and cached_hashes == {name: file["sha1"] for name, file in fingerprint.items()}:
+            summaries[run] = entry["summary"]
+        else:
+            stale.append(run)
+
+    # only new or changed runs are parsed, each in its own process
+    if stale:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for run, summary in zip(stale, executor.map(summarize_run, stale)):
+                summaries[run] = summary
+
+    for run in runs:
+        entries[run] = {"files": fingerprints[run], "summary": summaries[run]}
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump({"version": CACHE_VERSION, "runs": entries}, f)
+    os.replace(cache_path + ".tmp", cache_path)
+    return [summaries[run] for run in runs], stale
+
+def aggregate(summaries):
+    durations = {}
+    for summary in summaries:
+        for name, job in summary["jobs"].items():
+            durations.setdefault(name, []).append(job["duration"])
+    total_times = [summary["total_time"] for summary in summaries]
+    return {
+        "durations": {name: (np.mean(values), np.std(values)) for name, values in durations.items()},
+        "total_time": (np.mean(total_times), np.std(total_times)),
+        "slo_violations": sum(summary["slo_violations"] for summary in summaries),
+        "latencies": sum(summary["latencies"] for summary in summaries),
+    }
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot and summarize part 4 runs")
+    parser.add_argument("runs", nargs="*", default=["measurements/part44-interval4*"],
+                        help="run directories (or glob patterns) holding mcperf.txt and utilization.csv or a recording/ directory")
+    parser.add_argument("--cache", default="measurements/plot3_cache.json", help="where per-run summaries are kept")
+    parser.add_argument("--workers", type=int, default=None, help="processes summarizing new runs")
+    parser.add_argument("--output", default="plot4_4.svg")
+    args = parser.parse_args()
+
+    runs = find_runs(args.runs)
+    if not runs:
+        raise ValueError(f"No runs found in {' '.join(args.runs)}")
+    summaries, stale = load_summaries(runs, args.cache, args.workers)
+    print(f"Summarized {len(stale)} new or changed runs, {len(runs) - len(stale)} from cache")
+
+    # two plots per run, one row each
+    fig, axs = plt.subplots(len(runs), 2, figsize=(20, 20 / 3 * len(runs)), squeeze=False)
+    for i, summary in enumerate(summaries):
+        plot_A(axs[i, 0], f'{i + 1}A', summary["mcperf_ts"], summary["p95s"], summary["mcperf_qps"], '95th percentile latency', 'QPS')
+        plot_jobs(axs[i, 0], summary["jobs"])
+        plot_B(axs[i, 1], f'{i + 1}B', summary["jobs_ts"][1:], summary["cores"][1:], summary["jobs_qps"][1:], 'CPU cores', 'QPS')
+        plot_jobs(axs[i, 1], summary["jobs"], plot_type="B")
+
+        print(f"============== Run {i + 1} ==============")
+        for name in summary["jobs"]:
+            print(f"{name}: {summary['jobs'][name]['duration']}")
+        print(f"Last job end: {summary['last_job_end']}")
+        print(f"Number of latecies: {summary['latencies']}")
+        print(f"Percentage of violations: {summary['slo_percentage']}%")
+
+    totals = aggregate(summaries)
     print("============== Average ==============")
-    for name in durations:
-        print(f"mean({name}): {np.mean(durations[name])}")
-        print(f"std({name}): {np.std(durations[name])}")
+    for name, (mean, std) in totals["durations"].items():
+        print(f"mean({name}): {mean}")
+        print(f"std({name}): {std}")
 
     print("============== Total time ==============")
-    print(f"Run 1: {total_time1}")
-    print(f"Run 2: {total_time2}")
-    print(f"Run 3: {total_time3}")
-    print(f"Mean: {np.mean([total_time1, total_time2, total_time3])}")
-    print(f"std: {np.std([total_time1, total_time2, total_time3])}")
+    for i, summary in enumerate(summaries):
+        print(f"Run {i + 1}: {summary['total_time']}")
+    print(f"Mean: {totals['total_time'][0]}")
+    print(f"std: {totals['total_time'][1]}")
 
     print("============== SLO violations ==============")
-    print(f"Total SLO violations: {total_slo_violations}")
-    print(f"Total number of latencies: {total_len_p95s}")
-    print(f"Total percentage of violations: {total_slo_violations / total_len_p95s * 100}%")
+    print(f"Total SLO violations: {totals['slo_violations']}")
+    print(f"Total number of latencies: {totals['latencies']}")
+    print(f"Total percentage of violations: {totals['slo_violations'] / totals['latencies'] * 100}%")
     # add space between subplots
     plt.tight_layout()
     plt.subplots_adjust(hspace=0.35, wspace=0.2)
     # fig.legend(loc='upper left', fancybox=True, shadow=True)
 
-    plt.savefig('plot4_4.svg')
+    plt.savefig(args.output)
 
-    plt.show()
\ No newline at end of file
+    plt.show()
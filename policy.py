@@ -0,0 +1,122 @@
+import json
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+LEVELS = ['LOW', 'MEDIUM', 'HIGH']
+
+class CpuAssignment(NamedTuple):
+    cpus: List[int]
+    # CPU quota in cores, None means one core per CPU in the set
+    quota: Optional[float]
+
+class PhaseAssignment(NamedTuple):
+    jobs: List[Tuple[str, CpuAssignment]]
+    # None pauses the background job
+    background: Optional[CpuAssignment]
+
+class Policy(NamedTuple):
+    name: str
+    threads: Dict[str, int]
+    init_cpus: Dict[str, List[int]]
+    # Foreground jobs in start order, with ('any' | 'all', jobs that must exit first)
+    dependencies: Dict[str, Tuple[str, List[str]]]
+    background: List[str]
+    memcached: Dict[str, List[int]]
+    # (running foreground jobs, load level name, background job active) -> assignment
+    assignments: Dict[Tuple[FrozenSet[str], str, bool], PhaseAssignment]
+
+def _parse_cpus(value: Any, where: str) -> CpuAssignment:
+    if isinstance(value, list):
+        return CpuAssignment([int(cpu) for cpu in value], None)
+    if isinstance(value, dict) and 'cpus' in value:
+        quota = value.get('quota')
+        return CpuAssignment([int(cpu) for cpu in value['cpus']], float(quota) if quota is not None else None)
+    raise ValueError(f'{where}: expected a list of CPUs or {{cpus: [...], quota: N}}, got {value!r}')
+
+def _parse_dependencies(value: Any, where: str) -> Tuple[str, List[str]]:
+    if value is None:
+        return 'all', []
+    if isinstance(value, list):
+        return 'all', [str(job) for job in value]
+    if isinstance(value, dict) and len(value) == 1 and next(iter(value)) in ('any', 'all'):
+        mode, jobs = next(iter(value.items()))
+        return mode, [str(job) for job in jobs]
+    raise ValueError(f'{where}: expected a list of jobs, {{any: [...]}} or {{all: [...]}}, got {value!r}')
+
+def compile_policy(spec: Dict[str, Any], name: str = 'policy', known_jobs: Optional[Iterable[str]] = None) -> Policy:
+    jobs = spec.get('jobs') or {}
+    background_jobs = spec.get('background') or {}
+    all_jobs = list(jobs) + list(background_jobs)
+    if known_jobs is not None:
+        unknown = set(all_jobs) - set(known_jobs)
+        if unknown:
+            raise ValueError(f'{name}: unknown jobs {sorted(unknown)}')
+        # A job the policy leaves out would never run
+        uncovered = set(known_jobs) - set(all_jobs)
+        if uncovered:
+            raise ValueError(f'{name}: no entry for jobs {sorted(uncovered)}')
+    if len(set(all_jobs)) != len(all_jobs):
+        raise ValueError(f'{name}: a job cannot be both a foreground and a background job')
+
+    threads: Dict[str, int] = {}
+    init_cpus: Dict[str, List[int]] = {}
+    dependencies: Dict[str, Tuple[str, List[str]]] = {}
+    for job, job_spec in [*jobs.items(), *background_jobs.items()]:
+        threads[job] = int(job_spec.get('threads', 1))
+        init_cpus[job] = _parse_cpus(job_spec['cpus'], f'{name}: jobs.{job}.cpus').cpus
+    for job, job_spec in jobs.items():
+        dependencies[job] = _parse_dependencies(job_spec.get('after'), f'{name}: jobs.{job}.after')
+        missing = set(dependencies[job][1]) - set(jobs)
+        if missing:
+            raise ValueError(f'{name}: jobs.{job}.after refers to non-foreground jobs {sorted(missing)}')
+    # Jobs whose after can be met, found the way PolicyStrategy starts them;
+    # whatever is left waits on a cycle
+    startable: set = set()
+    changed = True
+    while changed:
+        changed = False
+        for job, (mode, after) in dependencies.items():
+            met = [dependency in startable for dependency in after]
+            if job not in startable and (any(met) if mode == 'any' else all(met)):
+                startable.add(job)
+                changed = True
+    if len(startable) != len(dependencies):
+        raise ValueError(f'{name}: jobs {sorted(set(dependencies) - startable)} can never start, their after forms a cycle')
+
+    memcached = {level: [int(cpu) for cpu in cpus] for level, cpus in (spec.get('memcached') or {}).items()}
+    if sorted(memcached) != sorted(LEVELS):
+        raise ValueError(f'{name}: memcached must list the CPUs for each of {LEVELS}')
+
+    assignments: Dict[Tuple[FrozenSet[str], str, bool], PhaseAssignment] = {}
+    for index, phase in enumerate(spec.get('phases') or []):
+        phase_jobs = frozenset(phase.get('jobs') or [])
+        if phase_jobs - set(jobs):
+            raise ValueError(f'{name}: phases[{index}] refers to non-foreground jobs {sorted(phase_jobs - set(jobs))}')
+        for level in LEVELS:
+            for variant, has_background in (('alone', False), ('shared', True)):
+                entry = (phase.get(level) or {}).get(variant)
+                if entry is None:
+                    continue
+                where = f'{name}: phases[{index}].{level}.{variant}'
+                key = (phase_jobs, level, has_background)
+                if key in assignments:
+                    raise ValueError(f'{where}: duplicate phase')
+                entry = dict(entry)
+                background = entry.pop('background', None)
+                if has_background and background is None:
+                    raise ValueError(f'{where}: missing background assignment (use "pause" to pause it)')
+                job_assignments = [(job, _parse_cpus(cpus, f'{where}.{job}')) for job, cpus in entry.items()]
+                if {job for job, _ in job_assignments} - phase_jobs:
+                    raise ValueError(f'{where}: assigns CPUs to jobs outside the phase')
+                assignments[key] = PhaseAssignment(job_assignments,
+                    None if background in (None, 'pause') else _parse_cpus(background, f'{where}.background'))
+
+    return Policy(name, threads, init_cpus, dependencies, list(background_jobs), memcached, assignments)
+
+def load_policy(path: str, known_jobs: Optional[Iterable[str]] = None) -> Policy:
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith('.json'):
+            spec = json.load(file)
+        else:
+            import yaml
+            spec = yaml.safe_load(file)
+    return compile_policy(spec, path, known_jobs)
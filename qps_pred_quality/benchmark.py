@@ -0,0 +1,207 @@
+import argparse
+import concurrent.futures
+import glob
+import importlib
+import os
+import sys
+from typing import Callable, List, NamedTuple, Optional, Tuple
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from qps_predictor import make_predictor
+from time_align import asof, mcperf_frame, utilization_frame
+
+# Scores QPS predictors against what mcperf measured on recorded runs, e.g.
+#   python3 qps_pred_quality/benchmark.py qps_pred_quality measurements/part4-*
+# A run is a directory with utilization.csv and mcperf.txt from the same
+# part 4 run. The memcached CPU usage (mcpu) in utilization.csv feeds the cpu
+# predictors; the net ones need monitor.py --header output saved as
+# performance.txt next to them. "recorded" scores the qps column the
+# scheduler predicted during the run.
+
+# Strategy1's load level thresholds, ThresholdController's defaults
+THRESHOLDS = (25000.0, 30000.0)
+BUILTIN = [f"{kind}-{feature}" for feature in ["cpu", "net"] for kind in ["static", "rls", "ewma"]]
+
+class Score(NamedTuple):
+    run: str
+    predictor: str
+    samples: int
+    mae: float
+    rmse: float
+    bias: float
+    # Shift in seconds that best lines the prediction up with the truth,
+    # positive when the prediction trails it
+    lag: float
+    # Seconds spent at a lower or higher load level than the truth called for
+    under_s: float
+    over_s: float
+    duration_s: float
+
+def make_factory(name: str) -> Tuple[Callable, str]:
+    # KIND-FEATURE for qps_predictor's predictors, or MODULE:FACTORY@FEATURE
+    # for anything with the same predict/update interface
+    if name in BUILTIN:
+        kind, feature = name.split("-")
+        return (lambda: make_predictor(kind, feature)), feature
+    target, _, feature = name.partition("@")
+    module, sep, attribute = target.partition(":")
+    if not sep:
+        raise ValueError(f"Unknown predictor {name}, expected one of {', '.join(BUILTIN)}, recorded or MODULE:FACTORY[@FEATURE]")
+    return getattr(importlib.import_module(module), attribute), feature or "cpu"
+
+def find_runs(patterns: List[str]) -> List[str]:
+    runs = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.isfile(os.path.join(path, "utilization.csv")) and os.path.isfile(os.path.join(path, "mcperf.txt")):
+                runs.add(os.path.abspath(path))
+    return sorted(runs)
+
+def load_performance(path: str) -> Optional[pd.DataFrame]:
+    # The packets column moves with monitor.py's --pid and --container
+    # options, so it is only found by name in the --header line
+    with open(path, "r", encoding="utf-8") as file:
+        header = file.readline()
+    names = header[1:].split() if header.startswith("#") else []
+    if "time" not in names or "packets" not in names:
+        print(f"{path} has no monitor.py --header line naming the packets column, skipping it", file=sys.stderr)
+        return None
+    performance = pd.read_csv(path, header=None, sep=r"\s+", comment="#", names=names, usecols=["time", "packets"])
+    performance = performance.rename(columns={"packets": "net"})
+    performance["time"] = (performance["time"] * 1e9).astype(np.int64)
+    return performance
+
+def load_run(run: str) -> pd.DataFrame:
+    # One row per scheduler tick: its time, the inputs, the recorded
+    # prediction and the QPS mcperf measured over the interval holding it
+    utilization = utilization_frame(os.path.join(run, "utilization.csv"))
+    mcperf = mcperf_frame(os.path.join(run, "mcperf.txt"))
+    times = utilization["time"].to_numpy()
+    frame = pd.DataFrame({"time": times, "cpu": utilization["mcpu"].to_numpy(), "recorded": utilization["qps"].to_numpy()})
+    frame["truth"] = asof(times, mcperf, ["QPS"])["QPS"].to_numpy()
+    frame.loc[times >= mcperf["end"].iloc[-1], "truth"] = np.nan
+    performance_path = os.path.join(run, "performance.txt")
+    performance = load_performance(performance_path) if os.path.isfile(performance_path) else None
+    if performance is not None:
+        frame["net"] = asof(times, performance, ["net"])["net"].to_numpy()
+    return frame[frame["truth"].notna()].reset_index(drop=True)
+
+def replay(frame: pd.DataFrame, factory: Callable, feature: str, calibrate_interval: Optional[float]) -> np.ndarray:
+    # Feeds the inputs through the predictor tick by tick as the scheduler
+    # would, refitting it on the measured QPS when calibrating
+    predictor = factory()
+    inputs = frame[feature].to_numpy()
+    truth = frame["truth"].to_numpy()
+    seconds = frame["time"].to_numpy() / 1e9
+    predictions = np.empty(len(frame))
+    last_update = seconds[0] if len(frame) else 0.0
+    for i in range(len(frame)):
+        predictions[i] = predictor.predict(inputs[i])
+        if calibrate_interval is not None and seconds[i] - last_update >= calibrate_interval:
+            predictor.update(inputs[i], truth[i])
+            last_update = seconds[i]
+    return predictions
+
+def best_lag(predictions: np.ndarray, truth: np.ndarray, max_shift: int) -> int:
+    # Shift (in ticks) of the prediction that minimizes the mean absolute error
+    best, best_error = 0, np.inf
+    for shift in range(-max_shift, max_shift + 1):
+        if shift >= 0:
+            error = np.abs(predictions[shift:] - truth[:len(truth) - shift])
+        else:
+            error = np.abs(predictions[:shift] - truth[-shift:])
+        if len(error) and error.mean() < best_error:
+            best, best_error = shift, error.mean()
+    return best
+
+def score(run: str, name: str, frame: pd.DataFrame, predictions: np.ndarray, max_lag: float) -> Score:
+    truth = frame["truth"].to_numpy()
+    seconds = frame["time"].to_numpy() / 1e9
+    # Each tick holds until the next one
+    tick = np.diff(seconds, append=seconds[-1] + np.median(np.diff(seconds))) if len(seconds) > 1 else np.ones(len(seconds))
+    errors = predictions - truth
+    predicted_levels = np.searchsorted(THRESHOLDS, predictions, side="right")
+    true_levels = np.searchsorted(THRESHOLDS, truth, side="right")
+    period = float(np.median(tick)) if len(tick) else 1.0
+    lag = best_lag(predictions, truth, max(0, int(round(max_lag / period)))) * period
+    return Score(run, name, len(truth), float(np.mean(np.abs(errors))), float(np.sqrt(np.mean(errors ** 2))),
+                 float(np.mean(errors)), lag, float(tick[predicted_levels < true_levels].sum()),
+                 float(tick[predicted_levels > true_levels].sum()), float(tick.sum()))
+
+def benchmark_run(run: str, predictors: List[str], calibrate_interval: Optional[float], max_lag: float) -> List[Score]:
+    frame = load_run(run)
+    scores = []
+    for name in predictors:
+        if name == "recorded":
+            scored = frame
+            predictions = frame["recorded"].to_numpy()
+        else:
+            factory, feature = make_factory(name)
+            if feature not in frame:
+                # No monitor output for this run
+                continue
+            # Ticks before the monitor's first sample have no input
+            scored = frame[frame[feature].notna()].reset_index(drop=True)
+            predictions = replay(scored, factory, feature, calibrate_interval)
+        scores.append(score(run, name, scored, predictions, max_lag))
+    return scores
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score QPS predictors on recorded part 4 runs")
+    parser.add_argument("runs", nargs="*", default=[os.path.dirname(os.path.abspath(__file__))],
+        help="run directories (or glob patterns) with utilization.csv and mcperf.txt")
+    parser.add_argument("--predictor", action="append", default=None,
+        help=f"{', '.join(BUILTIN)}, recorded or MODULE:FACTORY[@FEATURE]; all built-in ones by default")
+    parser.add_argument("--calibrate", action="store_true", help="refit online predictors on the measured QPS")
+    parser.add_argument("--calibrate-interval", type=float, default=1.0, metavar="SECONDS")
+    parser.add_argument("--max-lag", type=float, default=30.0, metavar="SECONDS", help="largest lag searched for")
+    parser.add_argument("--per-run", action="store_true", help="print every run's scores as well")
+    parser.add_argument("--max-mae", type=float, default=None, help="exit with an error if a predictor's MAE is higher")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    runs = find_runs(args.runs)
+    if not runs:
+        raise ValueError(f"No runs found in {' '.join(args.runs)}")
+    predictors = args.predictor if args.predictor is not None else ["recorded"] + BUILTIN
+    for name in predictors:
+        if name != "recorded":
+            make_factory(name)
+    calibrate_interval = args.calibrate_interval if args.calibrate else None
+
+    # Runs are independent, each is loaded once and scored in its own process
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(benchmark_run, run, predictors, calibrate_interval, args.max_lag) for run in runs]
+        scores = pd.DataFrame([score for future in futures for score in future.result()], columns=Score._fields)
+
+    header = f'{"predictor":<24} {"runs":>4} {"MAE":>9} {"RMSE":>9} {"bias":>9} {"lag [s]":>8} {"under [%]":>10} {"over [%]":>9}'
+    if args.per_run:
+        for run, run_scores in scores.groupby("run", sort=False):
+            print(run)
+            print(header)
+            for row in run_scores.itertuples():
+                print(f'{row.predictor:<24} {1:>4} {row.mae:>9.0f} {row.rmse:>9.0f} {row.bias:>9.0f} {row.lag:>8.1f} '
+                      f'{100 * row.under_s / row.duration_s:>10.2f} {100 * row.over_s / row.duration_s:>9.2f}')
+            print()
+
+    # Errors are weighted by samples, level errors by time, over all runs
+    print(header)
+    failed = []
+    for name in predictors:
+        rows = scores[scores["predictor"] == name]
+        if rows.empty:
+            print(f'{name:<24} {0:>4} {"no runs with its input":>30}')
+            continue
+        weights = rows["samples"]
+        mae = np.average(rows["mae"], weights=weights)
+        rmse = np.sqrt(np.average(rows["rmse"] ** 2, weights=weights))
+        bias = np.average(rows["bias"], weights=weights)
+        duration = rows["duration_s"].sum()
+        print(f'{name:<24} {len(rows):>4} {mae:>9.0f} {rmse:>9.0f} {bias:>9.0f} {rows["lag"].mean():>8.1f} '
+              f'{100 * rows["under_s"].sum() / duration:>10.2f} {100 * rows["over_s"].sum() / duration:>9.2f}')
+        if args.max_mae is not None and mae > args.max_mae:
+            failed.append(name)
+    if failed:
+        print(f'MAE above {args.max_mae:.0f}: {", ".join(failed)}', file=sys.stderr)
+        sys.exit(1)
@@ -1,38 +1,30 @@
-import pandas as pd
+import os
+import sys
 import matplotlib.pyplot as plt
-import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from time_align import asof, mcperf_frame, relative_seconds, utilization_frame
 
-mcperf_start = 1715940983644 / 1000
-mcperf_end = 1715941584255 / 1000
-# print(pd.to_datetime(mcperf_start, unit="ms"))
-# print(pd.to_datetime(mcperf_end, unit="ms"))
-mcperf_df = pd.read_csv("mcperf.txt", sep="\s+")
-times = np.linspace(mcperf_start, mcperf_end, num=len(mcperf_df))
-mcperf_df["time"] = times
-mcperf_df["time"] = mcperf_df["time"].astype(int)
-mcperf_df["time"] = mcperf_df["time"] - mcperf_start
-print(mcperf_df.head())
+# both sources in UTC epoch ns, the target of each mcperf interval comes
+# from its own start time instead of evenly spaced guesses
+mcperf_df = mcperf_frame("mcperf.txt")
+util_df = utilization_frame("utilization.csv")
+# target load at every utilization sample, next to the predicted qps
+util_df["target"] = asof(util_df["time"].to_numpy(), mcperf_df, ["target"])["target"]
 
-util_df = pd.read_csv("utilization.csv")
-# convert time in util_df from 2024-05-17T10:16:25.310071 to ms format
-util_df["time"] = pd.to_datetime(util_df["time"])
-util_df["time"] = util_df["time"].dt.strftime("%s")
-util_df["time"] = pd.to_numeric(util_df["time"]) + 7200
-util_df["time"] -= mcperf_start
-# # print time in readable format
-# util_df["time"] = pd.to_datetime(util_df["time"], unit="ms")
-# # increment by 2 hours to match the time in mcperf_df
-# util_df["time"] = util_df["time"] + pd.Timedelta(hours=2)
+mcperf_start = mcperf_df["start"].iloc[0]
+mcperf_df["time"] = relative_seconds(mcperf_df["start"], mcperf_start)
+util_df["time"] = relative_seconds(util_df["time"], mcperf_start)
+print(mcperf_df.head())
 print(util_df.head(20))
 
 print(mcperf_df.columns)
 # mcperf_df.plot(x="time", y="target")
 # step function for target
-plt.step(mcperf_df["time"], mcperf_df["target"], where="pre", label="target")
+plt.step(mcperf_df["time"], mcperf_df["target"], where="post", label="target")
 
 util_df.plot(x="time", y="qps", ax=plt.gca())
 plt.show()
 
 # print(len(util_df))
-# print(len(util_df[util_df["time"] >= mcperf_start]))
-# print(len(util_df[util_df["time"] <= mcperf_end]))
+# print(len(util_df[util_df["time"] >= 0]))
+# print(len(util_df[util_df["time"] <= relative_seconds(mcperf_df["end"].iloc[-1], mcperf_start)]))
@@ -0,0 +1,124 @@
+import socket
+from typing import Optional, Tuple
+
+# (slope, intercept) fitted offline by part4/fit_line.py's get_line_net/get_line_cpu
+NET_LINE = (0.99665492, -846.6694402145367)
+CPU_LINE = (585.58444342, -822.4653955572503)
+
+class LinearQpsPredictor:
+    def __init__(self, slope: float, intercept: float):
+        self.slope = slope
+        self.intercept = intercept
+
+    def predict(self, x: float) -> float:
+        return self.slope * x + self.intercept
+
+    def update(self, x: float, qps: float):
+        pass
+
+    def coefficients(self) -> Tuple[float, float]:
+        return self.slope, self.intercept
+
+class RecursiveLeastSquaresPredictor(LinearQpsPredictor):
+    def __init__(self, slope: float, intercept: float, forgetting: float = 0.99,
+                 initial_variance: float = 1.0, scale: float = 10000.0):
+        super().__init__(slope, intercept)
+        # Inputs are divided by scale so that both parameters are of a similar
+        # magnitude; the covariance is relative to the label noise variance
+        self.forgetting = forgetting
+        self.scale = scale
+        self.p = [[initial_variance, 0.0], [0.0, initial_variance]]
+
+    def update(self, x: float, qps: float):
+        x /= self.scale
+        p = self.p
+        # p @ [x, 1]
+        px0 = p[0][0] * x + p[0][1]
+        px1 = p[1][0] * x + p[1][1]
+        gain_denominator = self.forgetting + x * px0 + px1
+        k0 = px0 / gain_denominator
+        k1 = px1 / gain_denominator
+        error = qps - (self.slope * self.scale * x + self.intercept)
+        self.slope += k0 * error / self.scale
+        self.intercept += k1 * error
+        self.p = [[(p[0][0] - k0 * px0) / self.forgetting, (p[0][1] - k0 * px1) / self.forgetting],
+                  [(p[1][0] - k1 * px0) / self.forgetting, (p[1][1] - k1 * px1) / self.forgetting]]
+
+class EwmaLeastSquaresPredictor(LinearQpsPredictor):
+    def __init__(self, slope: float, intercept: float, alpha: float = 0.02,
+                 prior_weight: float = 10.0, prior_range: Tuple[float, float] = (5000.0, 100000.0)):
+        super().__init__(slope, intercept)
+        # Exponentially weighted sums for the normal equations, seeded with
+        # pseudo-observations on the offline line so the first live samples
+        # only nudge it
+        self.alpha = alpha
+        self.weight = self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        for qps in prior_range:
+            x = (qps - intercept) / slope
+            self._accumulate(x, qps, prior_weight / len(prior_range))
+
+    def _accumulate(self, x: float, qps: float, weight: float):
+        self.weight += weight
+        self.sum_x += weight * x
+        self.sum_y += weight * qps
+        self.sum_xx += weight * x * x
+        self.sum_xy += weight * x * qps
+
+    def update(self, x: float, qps: float):
+        decay = 1 - self.alpha
+        self.weight *= decay
+        self.sum_x *= decay
+        self.sum_y *= decay
+        self.sum_xx *= decay
+        self.sum_xy *= decay
+        self._accumulate(x, qps, self.alpha)
+        variance = self.weight * self.sum_xx - self.sum_x * self.sum_x
+        if variance <= 1e-9 * self.weight * self.sum_xx:
+            # All recent inputs are (almost) the same, keep the slope and
+            # only move the line through the weighted mean
+            self.intercept = (self.sum_y - self.slope * self.sum_x) / self.weight
+            return
+        self.slope = (self.weight * self.sum_xy - self.sum_x * self.sum_y) / variance
+        self.intercept = (self.sum_y - self.slope * self.sum_x) / self.weight
+
+class MemcachedStats:
+    def __init__(self, host: str = '127.0.0.1', port: int = 11211):
+        self.address = (host, port)
+        self.socket: Optional[socket.socket] = None
+
+    def requests(self) -> int:
+        # Total get + set commands served so far, from the memcached text protocol
+        try:
+            if self.socket is None:
+                self.socket = socket.create_connection(self.address, timeout=1.0)
+            self.socket.sendall(b'stats\r\n')
+            data = b''
+            while not data.endswith(b'END\r\n'):
+                chunk = self.socket.recv(8192)
+                if not chunk:
+                    raise ConnectionError('memcached closed the stats connection')
+                data += chunk
+        except OSError:
+            # A timed out reply may still arrive, start the next call on a
+            # fresh connection instead of reading its leftovers
+            self.close()
+            raise
+        total = 0
+        for line in data.split(b'\r\n'):
+            fields = line.split()
+            if len(fields) == 3 and fields[1] in (b'cmd_get', b'cmd_set'):
+                total += int(fields[2])
+        return total
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+def make_predictor(kind: str, feature: str) -> LinearQpsPredictor:
+    slope, intercept = NET_LINE if feature == 'net' else CPU_LINE
+    if kind == 'rls':
+        return RecursiveLeastSquaresPredictor(slope, intercept)
+    if kind == 'ewma':
+        return EwmaLeastSquaresPredictor(slope, intercept)
+    return LinearQpsPredictor(slope, intercept)
@@ -0,0 +1,154 @@
+import atexit
+import json
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+class CsvSink:
+    def __init__(self, path: str, max_rows: int = 256, max_delay: float = 5.0, separator: str = ','):
+        self.file = open(path, 'a', encoding='utf-8')
+        self.separator = separator
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.rows: List[str] = []
+        self.last_flush = time.monotonic()
+
+    def write(self, data: Iterable[Any]):
+        self.rows.append(self.separator.join([str(item) for item in data]))
+        if len(self.rows) >= self.max_rows or time.monotonic() - self.last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.file.write('\n'.join(self.rows) + '\n')
+            self.file.flush()
+            self.rows.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+def close_on_exit(*sinks):
+    # SIGTERM/SIGHUP would otherwise kill the scheduler without running
+    # atexit handlers, losing whatever rows are still buffered
+    for sink in sinks:
+        atexit.register(sink.close)
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: sys.exit(128 + signum))
+
+# Columnar recording of a scheduler run: fixed-width little-endian records
+# appended to one file per table, readable as NumPy structured arrays
+UTILIZATION_COLUMNS = [('time', '<i8'), ('cpu0', '<f8'), ('cpu1', '<f8'), ('cpu2', '<f8'), ('cpu3', '<f8'),
+    ('mcpu', '<f8'), ('mem', '<f8'), ('qps', '<f8'),
+    ('jobs0', '<u2'), ('jobs1', '<u2'), ('jobs2', '<u2'), ('jobs3', '<u2'), ('level', 'i1')]
+EVENT_COLUMNS = [('time', '<i8'), ('job', 'u1'), ('kind', 'u1'), ('cpus', '<u2'), ('quota', '<f4')]
+EVENT_KINDS = ['start', 'end', 'pause', 'unpause', 'cores']
+STRUCT_CODES = {'<i8': 'q', '<f8': 'd', '<u2': 'H', 'i1': 'b', 'u1': 'B', '<f4': 'f'}
+
+def record_struct(columns: List[Any]) -> struct.Struct:
+    return struct.Struct('<' + ''.join([STRUCT_CODES[kind] for _, kind in columns]))
+
+def cpu_mask(cpus: Iterable[int]) -> int:
+    return sum([1 << cpu for cpu in cpus])
+
+class ColumnarRecorder:
+    def __init__(self, path: str, jobs: List[str], max_rows: int = 256, max_delay: float = 5.0):
+        # Times are epoch nanoseconds, job sets are bitmasks over `jobs`
+        os.makedirs(path, exist_ok=True)
+        meta = {'jobs': jobs, 'utilization': UTILIZATION_COLUMNS, 'events': EVENT_COLUMNS,
+                'event_kinds': EVENT_KINDS}
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                if json.load(file) != json.loads(json.dumps(meta)):
+                    raise ValueError(f'{path} holds a recording with a different layout')
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as file:
+                json.dump(meta, file, indent=2)
+        self.jobs = {name: index for index, name in enumerate(jobs)}
+        self.utilization_struct = record_struct(UTILIZATION_COLUMNS)
+        self.event_struct = record_struct(EVENT_COLUMNS)
+        self.utilization_file = open(os.path.join(path, 'utilization.bin'), 'ab')
+        self.event_file = open(os.path.join(path, 'events.bin'), 'ab')
+        self.utilization = bytearray()
+        self.events = bytearray()
+        self.rows = 0
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.last_flush = time.monotonic()
+        # Events come from the Docker pool threads as well
+        self.lock = threading.Lock()
+
+    def write_utilization(self, time_ns: int, cpu_percents: List[float], memcached_cpu_percent: float,
+                          memory_percent: float, qps: float, cpus: List[List[str]], level: int):
+        masks = [sum([1 << self.jobs[name] for name in names]) for names in cpus]
+        with self.lock:
+            self.utilization += self.utilization_struct.pack(time_ns, *cpu_percents, memcached_cpu_percent,
+                memory_percent, qps, *masks, level)
+            self._written()
+
+    def write_event(self, time_ns: int, job: str, kind: str, cpus: Iterable[int] = (), quota: float = 0.0):
+        with self.lock:
+            self.events += self.event_struct.pack(time_ns, self.jobs[job], EVENT_KINDS.index(kind),
+                cpu_mask(cpus), quota)
+            self._written()
+
+    def _written(self):
+        self.rows += 1
+        if self.rows >= self.max_rows or time.monotonic() - self.last_flush >= self.max_delay:
+            self._flush()
+
+    def _flush(self):
+        # Only whole records reach the files, so a crash never leaves a torn one
+        for buffer, file in ((self.utilization, self.utilization_file), (self.events, self.event_file)):
+            if buffer:
+                file.write(buffer)
+                file.flush()
+                buffer.clear()
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            if not self.utilization_file.closed:
+                self._flush()
+                self.utilization_file.close()
+                self.event_file.close()
+
+class Recording(NamedTuple):
+    jobs: List[str]
+    utilization: Any
+    events: Any
+
+    def job_names(self, mask: int) -> List[str]:
+        return [name for index, name in enumerate(self.jobs) if mask & (1 << index)]
+
+    def event_kind(self, kind: str) -> int:
+        return EVENT_KINDS.index(kind)
+
+def load_recording(path: str) -> Recording:
+    # Memory-maps the tables, nothing is parsed or copied; works on a
+    # recording that is still being written, up to its last whole record
+    import numpy as np
+    with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    tables: Dict[str, Optional[Any]] = {}
+    for table in ('utilization', 'events'):
+        dtype = np.dtype([(name, kind) for name, kind in meta[table]])
+        table_path = os.path.join(path, f'{table}.bin')
+        count = os.path.getsize(table_path) // dtype.itemsize if os.path.exists(table_path) else 0
+        if count == 0:
+            tables[table] = np.empty(0, dtype=dtype)
+        else:
+            tables[table] = np.memmap(table_path, dtype=dtype, mode='r', shape=(count,))
+    return Recording(meta['jobs'], tables['utilization'], tables['events'])
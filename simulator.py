@@ -0,0 +1,344 @@
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import heapq
+import io
+import itertools
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, NamedTuple, Tuple
+import part4
+from core_allocator import CoreAllocator
+from job_profiles import PROFILES, speedup
+from mcperf_parser import McperfFile
+from policy import load_policy
+
+BENCHMARKS = {name: job.benchmark for name, job in part4.JOBS.items()}
+# The fake containers are not thread-safe, issue the "Docker" calls in order
+part4.DOCKER_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+class Trace(NamedTuple):
+    # Offered QPS per bucket and the bucket length in seconds
+    qps: List[float]
+    interval: float
+
+def load_trace(path: str) -> Trace:
+    mcperf = McperfFile(path)
+    rows = list(mcperf.rows())
+    return Trace([row.qps for row in rows], mcperf.interval(rows))
+
+class FakeContainer:
+    def __init__(self, simulation: 'Simulation', name: str):
+        self.simulation = simulation
+        self.name = name
+        self.id = name
+        self.attrs = {'State': {'Status': 'created', 'StartedAt': '', 'FinishedAt': ''}}
+        self.cpuset: List[int] = []
+        self.quota = 0.0
+
+    def _timestamp(self) -> str:
+        # Docker's RFC 3339 timestamps with nanoseconds, which Job cuts to microseconds
+        timestamp = self.simulation.epoch + datetime.timedelta(seconds=self.simulation.now)
+        return timestamp.strftime(part4.time_format) + '000Z'
+
+    def update(self, cpuset_cpus: str, cpu_period: int, cpu_quota: int):
+        self.simulation.advance()
+        self.cpuset = [int(cpu) for cpu in cpuset_cpus.split(',') if cpu]
+        self.quota = cpu_quota / cpu_period
+        self.simulation.reconfigurations += 1
+        self.simulation.reschedule()
+
+    def start(self):
+        self.simulation.advance()
+        self.attrs['State']['Status'] = 'running'
+        self.attrs['State']['StartedAt'] = self._timestamp()
+        self.simulation.reschedule()
+
+    def pause(self):
+        self.simulation.advance()
+        self.attrs['State']['Status'] = 'paused'
+        self.simulation.reconfigurations += 1
+        self.simulation.reschedule()
+
+    def unpause(self):
+        self.simulation.advance()
+        self.attrs['State']['Status'] = 'running'
+        self.simulation.reconfigurations += 1
+        self.simulation.reschedule()
+
+    def exit(self):
+        self.attrs['State']['Status'] = 'exited'
+        self.attrs['State']['FinishedAt'] = self._timestamp()
+
+    def reload(self):
+        pass
+
+    def logs(self) -> bytes:
+        return b''
+
+    def remove(self):
+        pass
+
+class FakeContainers:
+    def __init__(self, simulation: 'Simulation'):
+        self.simulation = simulation
+
+    def create(self, image: str, cmd: str, detach: bool, name: str, cpuset_cpus: str = '',
+               cpu_period: int = 100000, cpu_quota: int = 0) -> FakeContainer:
+        container = FakeContainer(self.simulation, name)
+        container.cpuset = [int(cpu) for cpu in cpuset_cpus.split(',') if cpu]
+        container.quota = cpu_quota / cpu_period
+        self.simulation.containers[name] = container
+        return container
+
+class FakeClient:
+    def __init__(self, simulation: 'Simulation'):
+        self.containers = FakeContainers(simulation)
+
+class FakeProcess:
+    def __init__(self, simulation: 'Simulation'):
+        self.simulation = simulation
+        self.cpus = [0, 1]
+
+    def cpu_affinity(self, cpus: List[int]):
+        self.simulation.advance()
+        if cpus != self.cpus:
+            self.simulation.reconfigurations += 1
+        self.cpus = list(cpus)
+        self.simulation.reschedule()
+
+class Config(NamedTuple):
+    strategy: str
+    controller: str
+    allocator: bool
+    trace: str
+    seed: int
+    tick: float = 1.0
+    events: bool = False
+    noise: float = 0.05
+    runtime_jitter: float = 0.05
+    capacity_per_core: float = 70000.0
+    reallocate_interval: float = 5.0
+    pause_mode: str = 'docker'
+
+class Result(NamedTuple):
+    config: Config
+    makespan: float
+    slo_violations: float
+    reconfigurations: int
+    level_changes: int
+    runtimes: Dict[str, float]
+
+class Simulation:
+    def __init__(self, config: Config, trace: Trace):
+        self.config = config
+        self.trace = trace
+        self.random = random.Random(config.seed)
+        self.epoch = datetime.datetime(2024, 1, 1)
+        self.now = 0.0
+        self.last_advance = 0.0
+        self.containers: Dict[str, FakeContainer] = {}
+        self.work: Dict[str, float] = {}
+        self.progress: Dict[str, float] = {}
+        self.rates: Dict[str, float] = {}
+        self.threads: Dict[str, int] = {}
+        self.memcached = FakeProcess(self)
+        self.reconfigurations = 0
+        # Seconds of each QPS bucket during which memcached lacked capacity
+        self.overloaded: Dict[int, float] = {}
+        self.events: List[Tuple[float, int, str, str]] = []
+        self.counter = itertools.count()
+        self.version = 0
+
+    def qps(self, t: float) -> float:
+        return self.trace.qps[int(t // self.trace.interval) % len(self.trace.qps)]
+
+    def _core_loads(self, qps: float) -> Tuple[Dict[int, float], float]:
+        # Every job spreads its quota evenly over its cpuset; memcached spreads
+        # its demand for qps over its cores. Oversubscribed cores are shared fairly.
+        memcached_demand = min(1.0, qps / (self.config.capacity_per_core * len(self.memcached.cpus)))
+        loads = {cpu: memcached_demand for cpu in self.memcached.cpus}
+        for container in self.containers.values():
+            if container.attrs['State']['Status'] == 'running' and container.cpuset:
+                for cpu in container.cpuset:
+                    loads[cpu] = loads.get(cpu, 0.0) + min(1.0, container.quota / len(container.cpuset))
+        served = sum(memcached_demand / max(1.0, loads[cpu]) for cpu in self.memcached.cpus)
+        return loads, served * self.config.capacity_per_core
+
+    def reschedule(self):
+        # Rates only change when the scheduler reconfigures something or the
+        # load changes, so recompute them and the next completion here
+        loads, _ = self._core_loads(self.qps(self.now))
+        self.rates = {}
+        for name, container in self.containers.items():
+            if container.attrs['State']['Status'] != 'running' or not container.cpuset:
+                continue
+            share = sum(min(1.0, container.quota / len(container.cpuset)) / max(1.0, loads[cpu]) for cpu in container.cpuset)
+            self.rates[name] = speedup(PROFILES[name].parallel_fraction, share, self.threads[name])
+        self.version += 1
+        for name, rate in self.rates.items():
+            if rate > 0:
+                finish = self.now + (self.work[name] - self.progress[name]) / rate
+                heapq.heappush(self.events, (finish, next(self.counter), 'finish', f'{name}:{self.version}'))
+
+    def advance(self):
+        elapsed = self.now - self.last_advance
+        if elapsed <= 0:
+            return
+        for name, rate in self.rates.items():
+            self.progress[name] = min(self.work[name], self.progress[name] + rate * elapsed)
+        # The time since the last advance all falls in one bucket (the load
+        # changing reschedules), so it is charged against that bucket's QPS
+        qps = self.qps(self.last_advance)
+        _, served = self._core_loads(qps)
+        if served + 1e-6 < qps:
+            bucket = int(self.last_advance // self.trace.interval)
+            self.overloaded[bucket] = self.overloaded.get(bucket, 0.0) + elapsed
+        self.last_advance = self.now
+
+    def run(self) -> Result:
+        config = self.config
+        part4.JOBS.clear()
+        part4.Job.pause_mode = config.pause_mode
+        part4.JOBS.update({name: part4.Job(name, benchmark) for name, benchmark in BENCHMARKS.items()})
+        controller = part4.PredictiveController() if config.controller == 'predictive' else part4.ThresholdController()
+        if config.strategy == 'strategy1':
+            strategy = part4.Strategy1(controller)
+        else:
+            strategy = part4.PolicyStrategy(load_policy(config.strategy, part4.JOBS.keys()), controller)
+        allocator = CoreAllocator() if config.allocator else None
+        client = FakeClient(self)
+        for name, job in part4.JOBS.items():
+            self.threads[name] = strategy.get_threads_for_job(job)
+            job.create(client, self.threads[name], strategy.get_init_cpuset_for_job(job))
+            self.work[name] = PROFILES[name].runtime * self.random.lognormvariate(0, config.runtime_jitter)
+            self.progress[name] = 0.0
+
+        load_level = part4.LoadLevel.LOW
+        with part4.batched_updates():
+            part4.run_new_jobs(strategy)
+            strategy.update_load_level(load_level, self.memcached)
+        level_changes = 0
+        last_reallocation = 0.0
+        heapq.heappush(self.events, (self.trace.interval, next(self.counter), 'bucket', ''))
+        heapq.heappush(self.events, (config.tick, next(self.counter), 'tick', ''))
+
+        # Even running everything on a single core leaves plenty of slack
+        deadline = 2 * sum(self.work.values())
+        while self.events:
+            self.now, _, kind, payload = heapq.heappop(self.events)
+            if self.now > deadline:
+                raise RuntimeError(f'{config.strategy} did not finish all jobs within {deadline:.0f}s')
+            self.advance()
+            if kind == 'bucket':
+                # Memcached's demand changed, and with it the contention
+                heapq.heappush(self.events, (self.now + self.trace.interval, next(self.counter), 'bucket', ''))
+                self.reschedule()
+                continue
+            if kind == 'finish':
+                name, version = payload.split(':')
+                if int(version) != self.version or self.containers[name].attrs['State']['Status'] != 'running':
+                    continue
+                self.progress[name] = self.work[name]
+                self.containers[name].exit()
+                self.reschedule()
+                if not config.events:
+                    continue
+            else:
+                heapq.heappush(self.events, (self.now + config.tick, next(self.counter), 'tick', ''))
+
+            # One iteration of the part4.py main loop
+            predicted_qps = self.qps(self.now) * (1 + self.random.gauss(0, config.noise))
+            if allocator is not None and kind == 'tick':
+                for name, rate in self.rates.items():
+                    allocator.observe(name, self.containers[name].quota, rate, config.tick, self.progress[name])
+            with part4.batched_updates():
+                level_changed = False
+                if kind == 'tick':
+                    # Like part4.py, container events alone measure nothing
+                    # new, so only ticks decide the load level
+                    new_load_level = strategy.get_new_load_level(predicted_qps, load_level, self.now)
+                    level_changed = new_load_level != load_level
+                    if level_changed:
+                        strategy.update_load_level(new_load_level, self.memcached)
+                        load_level = new_load_level
+                        level_changes += 1
+                any_job_finished = False
+                for job in part4.JOBS.values():
+                    if job.status() == 'exited' and not job.finished:
+                        job.finished = True
+                        any_job_finished = True
+                if any_job_finished:
+                    part4.run_new_jobs(strategy)
+                    strategy.update_load_level(load_level, self.memcached)
+                if allocator is not None and (level_changed or any_job_finished or
+                        self.now - last_reallocation >= config.reallocate_interval):
+                    part4.reallocate_cores(allocator, strategy, load_level)
+                    last_reallocation = self.now
+            if all(job.status() == 'exited' for job in part4.JOBS.values()):
+                break
+
+        # Read the times back through Job like part4/plot3.py does from jobs.csv
+        finished = {name: (job.end_time() - self.epoch).total_seconds() for name, job in part4.JOBS.items()}
+        started = {name: (job.start_time() - self.epoch).total_seconds() for name, job in part4.JOBS.items()}
+        first_start = min(started.values())
+        makespan = max(finished.values()) - first_start
+        # Same window as part4/plot3.py's get_slo_violations: buckets while jobs ran
+        first_bucket = int(first_start // self.trace.interval)
+        last_bucket = int(max(finished.values()) // self.trace.interval)
+        buckets = range(first_bucket, last_bucket + 1)
+        violated = [self.overloaded.get(bucket, 0.0) > 0.05 * self.trace.interval for bucket in buckets]
+        return Result(config, makespan, 100 * sum(violated) / max(1, len(violated)),
+                      self.reconfigurations, level_changes,
+                      {name: finished[name] - started[name] for name in started})
+
+def simulate(config: Config) -> Result:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Simulation(config, load_trace(config.trace)).run()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Replay mcperf traces against part4.py scheduling strategies')
+    parser.add_argument('traces', nargs='+', help='mcperf output files from part 4 runs')
+    parser.add_argument('--strategy', action='append', default=None,
+        help='strategy1 or the path to a policy file; can be given several times')
+    parser.add_argument('--controller', action='append', choices=['threshold', 'predictive'], default=None)
+    parser.add_argument('--allocator', choices=['off', 'on', 'both'], default='off')
+    parser.add_argument('--seeds', type=int, default=5)
+    parser.add_argument('--tick', type=float, default=1.0, help='scheduler loop period in seconds')
+    parser.add_argument('--events', action='store_true', help='react to job exits immediately, like part4.py --events')
+    parser.add_argument('--noise', type=float, default=0.05, help='relative noise of the QPS prediction')
+    parser.add_argument('--capacity-per-core', type=float, default=70000.0,
+        help='QPS one memcached core serves within the SLO')
+    parser.add_argument('--pause-mode', choices=['docker', 'throttle'], default='docker',
+        help='how background jobs are stopped at high load, like part4.py --pause-mode')
+    parser.add_argument('--workers', type=int, default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    allocators = {'off': [False], 'on': [True], 'both': [False, True]}[args.allocator]
+    configs = [Config(strategy, controller, allocator, trace, seed, args.tick, args.events, args.noise,
+                      capacity_per_core=args.capacity_per_core, pause_mode=args.pause_mode)
+               for strategy in args.strategy or ['strategy1']
+               for controller in args.controller or ['threshold']
+               for allocator in allocators
+               for trace in args.traces
+               for seed in range(args.seeds)]
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        results = list(executor.map(simulate, configs))
+
+    groups: Dict[Tuple[str, str, bool], List[Result]] = {}
+    for result in results:
+        groups.setdefault((result.config.strategy, result.config.controller, result.config.allocator), []).append(result)
+    print(f'{"strategy":<32} {"controller":<11} {"alloc":<6} {"makespan [s]":>16} {"SLO viol. [%]":>14} {"reconfigs":>10}')
+    for (strategy, controller, allocator), group in groups.items():
+        makespans = [result.makespan for result in group]
+        print(f'{strategy:<32} {controller:<11} {str(allocator):<6} '
+              f'{statistics.mean(makespans):>8.1f} ± {statistics.pstdev(makespans):<5.1f} '
+              f'{statistics.mean([result.slo_violations for result in group]):>14.2f} '
+              f'{statistics.mean([result.reconfigurations for result in group]):>10.1f}')
+    print(f'{len(results)} simulations in {time.perf_counter() - start:.2f}s', file=sys.stderr)
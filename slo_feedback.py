@@ -0,0 +1,128 @@
+import abc
+import argparse
+import socket
+import sys
+import threading
+import time
+from typing import List, NamedTuple, Optional
+from mcperf_parser import McperfFile, McperfParser, McperfRow
+
+# Tail of the measuring client's mcperf output, e.g. on the client VM:
+#   stdbuf -oL ~/memcache-perf/mcperf ... | tee ~/mcperf.txt | nc MEMCACHED_INTERNAL_IP 5555
+# with part4.py --slo-feed tcp:5555. For testing without the cluster, replay
+# a recorded run into the same port:
+#   python3 slo_feedback.py part_4_3_results_group_019/mcperf_1.txt --tcp 127.0.0.1:5555
+
+class LatencySample(NamedTuple):
+    # Monotonic time the line arrived at
+    time: float
+    # Latency in µs, as printed by mcperf
+    p95: float
+    qps: float
+
+class LatencyFeed(abc.ABC):
+    def __init__(self):
+        # Finds the columns by name in the #type header whenever one comes by
+        self.parser = McperfParser()
+        self.sample: Optional[LatencySample] = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='slo-feed', daemon=True)
+
+    def feed_line(self, line: str):
+        values = self.parser.parse_line(line)
+        if values is not None:
+            self.feed_row(self.parser.row(values))
+
+    def feed_row(self, row: McperfRow):
+        sample = LatencySample(time.monotonic(), row.p95, row.qps)
+        with self.lock:
+            self.sample = sample
+
+    def latest(self) -> Optional[LatencySample]:
+        with self.lock:
+            return self.sample
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+
+    @abc.abstractmethod
+    def _run(self):
+        # Feeds lines or rows in until stopped is set
+        pass
+
+class FileFeed(LatencyFeed):
+    def __init__(self, path: str, poll: float = 0.1):
+        super().__init__()
+        self.path = path
+        self.poll = poll
+
+    def _run(self):
+        for row in McperfFile(self.path).follow(self.stopped, self.poll):
+            self.feed_row(row)
+
+class SocketFeed(LatencyFeed):
+    def __init__(self, port: int, host: str = '0.0.0.0'):
+        super().__init__()
+        self.server = socket.create_server((host, port))
+        self.server.settimeout(1.0)
+
+    def _run(self):
+        # One producer at a time; a new one may connect after the last left
+        while not self.stopped.is_set():
+            try:
+                connection, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            with connection, connection.makefile('r', encoding='utf-8', errors='replace') as stream:
+                for line in stream:
+                    self.feed_line(line)
+                    if self.stopped.is_set():
+                        break
+
+    def close(self):
+        super().close()
+        self.server.close()
+
+def open_feed(spec: str) -> LatencyFeed:
+    kind, _, target = spec.partition(':')
+    if kind == 'file' and target:
+        return FileFeed(target)
+    if kind == 'tcp' and target:
+        host, _, port = target.rpartition(':')
+        return SocketFeed(int(port), host or '0.0.0.0')
+    raise ValueError(f'Unknown SLO feed {spec}, expected file:PATH or tcp:[HOST:]PORT')
+
+def replay(lines: List[str], output, interval: float):
+    # Headers go out at once, every measurement line one interval apart
+    for line in lines:
+        if line.startswith('read'):
+            time.sleep(interval)
+        output.write(line)
+        output.flush()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded mcperf run as a stand-in SLO feed')
+    parser.add_argument('trace', help='mcperf output to replay')
+    parser.add_argument('--tcp', default=None, metavar='HOST:PORT', help='send to part4.py --slo-feed tcp:PORT')
+    parser.add_argument('--file', default=None, metavar='PATH', help='append to part4.py --slo-feed file:PATH')
+    parser.add_argument('--interval', type=float, default=None, metavar='SECONDS',
+        help='time between measurement lines, by default taken from the trace timestamps')
+    args = parser.parse_args()
+    with open(args.trace, 'r', encoding='utf-8') as file:
+        lines = file.readlines()
+    interval = args.interval if args.interval is not None else McperfFile(args.trace).interval()
+    if args.tcp is not None:
+        host, _, port = args.tcp.rpartition(':')
+        with socket.create_connection((host or '127.0.0.1', int(port))) as connection:
+            replay(lines, connection.makefile('w', encoding='utf-8'), interval)
+    elif args.file is not None:
+        with open(args.file, 'a', encoding='utf-8') as output:
+            replay(lines, output, interval)
+    else:
+        replay(lines, sys.stdout, interval)
@@ -18,7 +18,10 @@ MEMCACHED_INTERNAL_IP=`echo "$NODE_INFO" | grep memcache-server | tr -s ' ' | cu
 echo "Setting up tools..."
 SetupMcperf "$CLIENT_MEASURE_EXTERNAL_IP" &
 SetupMcperf "$CLIENT_AGENT_EXTERNAL_IP" &
-CopyToVM performance_memcached.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM monitor.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM telemetry.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM cgroup.py "$MEMCACHED_EXTERNAL_IP:"
+CopyToVM recorder.py "$MEMCACHED_EXTERNAL_IP:"
 RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo apt-get update; sudo apt-get install -y tmux python3-pip memcached libmemcached-tools; sudo python3 -m pip install psutil" > /dev/null
 wait
 
@@ -37,4 +40,4 @@ MEMCACHED_PID=`RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo systemctl status memcac
 echo "Detected Memcached running on PID $MEMCACHED_PID."
 sleep 3
 RunCommand "$MEMCACHED_EXTERNAL_IP" "sudo taskset -a -cp $taskset_cpus $MEMCACHED_PID"
-(RunCommand "$MEMCACHED_EXTERNAL_IP" "python3 ~/performance_memcached.py $MEMCACHED_PID" | tee "measurements/part4/performance-c$cores-t$threads-$run.txt" &)
+(RunCommand "$MEMCACHED_EXTERNAL_IP" "python3 ~/monitor.py --pid $MEMCACHED_PID --rate 10 --header" | tee "measurements/part4/performance-c$cores-t$threads-$run.txt" &)
@@ -0,0 +1,223 @@
+import collections
+import itertools
+import os
+import threading
+import time
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import psutil
+from cgroup import cpu_usage_file, find_container_cgroup, parse_cpu_usage
+
+class Sample(NamedTuple):
+    time: float
+    # (busy, total) CPU time in seconds, per CPU
+    cpus: List[Tuple[float, float]]
+    memcached_cpu: float
+    packets_recv: int
+    memory_percent: float
+    # Total CPU time in seconds, per tracked container
+    containers: Dict[str, float]
+
+class Window(NamedTuple):
+    start: float
+    end: float
+    cpu_percents: List[float]
+    memcached_cpu_percent: float
+    packets_per_second: float
+    memory_percent: float
+    container_cpu_percents: Dict[str, float]
+
+class PsutilBackend:
+    def __init__(self, pid: int):
+        self.process = psutil.Process(pid)
+
+    def cpus(self) -> List[Tuple[float, float]]:
+        result = []
+        for times in psutil.cpu_times(percpu=True):
+            # guest and guest_nice are already counted in user and nice
+            total = sum(times) - getattr(times, 'guest', 0.0) - getattr(times, 'guest_nice', 0.0)
+            result.append((total - times.idle - getattr(times, 'iowait', 0.0), total))
+        return result
+
+    def memcached_cpu(self) -> float:
+        times = self.process.cpu_times()
+        return times.user + times.system
+
+    def packets_recv(self) -> int:
+        return psutil.net_io_counters().packets_recv
+
+    def memory_percent(self) -> float:
+        return psutil.virtual_memory().percent
+
+    def add_container(self, name: str, container_id: str):
+        pass
+
+    def containers(self) -> Dict[str, float]:
+        return {}
+
+class ProcFile:
+    def __init__(self, path: str, size: int = 4096):
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(size)
+
+    def read(self) -> int:
+        # procfs regenerates the contents on every read from offset 0, so the
+        # file can stay open and be re-read into the same buffer. Only the
+        # length comes back; callers slice out just the parts they parse
+        length = os.preadv(self.fd, [self.buffer], 0)
+        while length == len(self.buffer):
+            self.buffer = bytearray(2 * len(self.buffer))
+            length = os.preadv(self.fd, [self.buffer], 0)
+        return length
+
+    def lines(self, length: int, start: int = 0) -> Iterator[bytearray]:
+        # Lines of the last read from start on, copied one at a time as needed
+        while start < length:
+            end = self.buffer.find(b'\n', start, length)
+            end = length if end < 0 else end
+            yield self.buffer[start:end]
+            start = end + 1
+
+    def close(self):
+        os.close(self.fd)
+
+class ProcBackend:
+    def __init__(self, pid: Optional[int], interface: Optional[str] = None):
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.num_cpus = os.cpu_count() or 1
+        self.stat = ProcFile('/proc/stat', 8192)
+        # Without a process only the node-wide counters are read
+        self.process_stat = ProcFile(f'/proc/{pid}/stat', 1024) if pid is not None else None
+        self.net_dev = ProcFile('/proc/net/dev', 4096)
+        self.meminfo = ProcFile('/proc/meminfo', 8192)
+        self.interface = interface.encode() if interface is not None else None
+        self.container_files: Dict[str, ProcFile] = {}
+
+    def cpus(self) -> List[Tuple[float, float]]:
+        length = self.stat.read()
+        result = []
+        # Skip the aggregate "cpu " line, the per-CPU lines follow right after
+        # it; the long intr and softirq lines after them are never copied
+        lines = self.stat.lines(length, self.stat.buffer.index(b'\n', 0, length) + 1)
+        for line in itertools.islice(lines, self.num_cpus):
+            # user nice system idle iowait irq softirq steal (guest is already in user)
+            fields = line.split(None, 9)
+            user, nice, system, idle, iowait, irq, softirq, steal = [int(field) for field in fields[1:9]]
+            total = user + nice + system + idle + iowait + irq + softirq + steal
+            result.append(((total - idle - iowait) / self.ticks, total / self.ticks))
+        return result
+
+    def memcached_cpu(self) -> float:
+        if self.process_stat is None:
+            return 0.0
+        length = self.process_stat.read()
+        data = self.process_stat.buffer
+        # The command name may contain spaces, so count fields from the last ')'
+        fields = data[data.rindex(b')', 0, length) + 2:length].split(None, 13)
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def packets_recv(self) -> int:
+        length = self.net_dev.read()
+        packets = 0
+        for line in itertools.islice(self.net_dev.lines(length), 2, None):
+            name, sep, counters = line.partition(b':')
+            if not sep or (self.interface is not None and name.strip() != self.interface):
+                continue
+            packets += int(counters.split(None, 2)[1])
+        return packets
+
+    def memory_percent(self) -> float:
+        length = self.meminfo.read()
+        data = self.meminfo.buffer
+        total = int(data[data.index(b'MemTotal:', 0, length) + 9:data.index(b'kB', 0, length)])
+        start = data.index(b'MemAvailable:', 0, length) + 13
+        available = int(data[start:data.index(b'kB', start, length)])
+        return 100 * (total - available) / total
+
+    def add_container(self, name: str, container_id: str):
+        path = find_container_cgroup(container_id)
+        if path is not None:
+            self.add_cgroup(name, path)
+
+    def add_cgroup(self, name: str, path: str):
+        self.container_files[name] = ProcFile(cpu_usage_file(path), 1024)
+
+    def containers(self) -> Dict[str, float]:
+        result = {}
+        for name, file in list(self.container_files.items()):
+            try:
+                length = file.read()
+                result[name] = parse_cpu_usage(file.buffer[:length])
+            except OSError:
+                # The cgroup goes away together with the container
+                file.close()
+                del self.container_files[name]
+        return result
+
+    def close(self):
+        for file in [self.stat, self.process_stat, self.net_dev, self.meminfo, *self.container_files.values()]:
+            if file is not None:
+                file.close()
+
+class Sampler:
+    def __init__(self, backend, period: float = 0.1, history: float = 10.0,
+                 notify: Optional[threading.Event] = None):
+        self.backend = backend
+        self.period = period
+        self.samples: Deque[Sample] = collections.deque(maxlen=max(2, int(history / period) + 1))
+        self.lock = threading.Lock()
+        self.notify = notify
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+
+    def sample(self) -> Sample:
+        return Sample(time.monotonic(), self.backend.cpus(), self.backend.memcached_cpu(),
+                      self.backend.packets_recv(), self.backend.memory_percent(), self.backend.containers())
+
+    def start(self):
+        self.samples.append(self.sample())
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while True:
+            deadline += self.period
+            if self.stopped.wait(max(0.0, deadline - time.monotonic())):
+                return
+            sample = self.sample()
+            with self.lock:
+                self.samples.append(sample)
+            if self.notify is not None:
+                self.notify.set()
+
+    def latest(self) -> Sample:
+        with self.lock:
+            return self.samples[-1]
+
+    def window(self, seconds: float) -> Window:
+        with self.lock:
+            last = self.samples[-1]
+            first = self.samples[0]
+            for sample in reversed(self.samples):
+                first = sample
+                if last.time - sample.time >= seconds:
+                    break
+        return window_between(first, last)
+
+def window_between(first: Sample, last: Sample) -> Window:
+    elapsed = last.time - first.time
+    if elapsed <= 0:
+        return Window(first.time, last.time, [0.0] * len(last.cpus), 0.0, 0.0, last.memory_percent, {})
+    cpu_percents = []
+    for (busy_start, total_start), (busy_end, total_end) in zip(first.cpus, last.cpus):
+        total = total_end - total_start
+        cpu_percents.append(100 * (busy_end - busy_start) / total if total > 0 else 0.0)
+    container_cpu_percents = {name: 100 * (usage - first.containers[name]) / elapsed
+                              for name, usage in last.containers.items() if name in first.containers}
+    return Window(first.time, last.time, cpu_percents,
+                  100 * (last.memcached_cpu - first.memcached_cpu) / elapsed,
+                  (last.packets_recv - first.packets_recv) / elapsed,
+                  last.memory_percent, container_cpu_percents)
@@ -0,0 +1,105 @@
+import json
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from mcperf_parser import McperfFile
+
+# Every source is brought to UTC epoch nanoseconds (int64):
+#  - mcperf prints epoch milliseconds, per line in part 3's ts_start/ts_end
+#    columns or for the whole run in part 4's Timestamp header;
+#  - utilization.csv and jobs.csv hold naive ISO times written on the
+#    memcached VM, whose clock is in UTC, e.g. 2024-05-17T10:16:25.310071;
+#  - Kubernetes and Docker print RFC 3339 times in UTC, e.g. 2024-05-14T21:11:26Z.
+# Reading the naive times in the local time zone of the machine running the
+# analysis is what the old +7200 offsets made up for.
+
+def from_epoch_ms(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.int64) * 1_000_000
+
+def from_naive_iso(values, tz: str = 'UTC') -> np.ndarray:
+    # tz is the time zone of the clock that wrote the times
+    times = pd.to_datetime(pd.Series(values), format='ISO8601')
+    return times.dt.tz_localize(tz).dt.tz_convert('UTC').dt.tz_localize(None) \
+        .to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+def from_rfc3339(values) -> np.ndarray:
+    times = pd.to_datetime(pd.Series(values), format='ISO8601', utc=True)
+    return times.dt.tz_localize(None).to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+def mcperf_frame(path: str) -> pd.DataFrame:
+    # One row per mcperf line with every column plus the window it measured,
+    # [start, end) in epoch ns. Part 4's output only has the run's window,
+    # which the lines split evenly
+    mcperf = McperfFile(path)
+    frame = pd.DataFrame(mcperf.arrays())
+    if 'ts_start' in frame and 'ts_end' in frame:
+        frame['start'] = from_epoch_ms(frame['ts_start'])
+        frame['end'] = from_epoch_ms(frame['ts_end'])
+    elif mcperf.timestamp_start is not None and mcperf.timestamp_end is not None:
+        edges = np.linspace(mcperf.timestamp_start, mcperf.timestamp_end, num=len(frame) + 1)
+        frame['start'] = from_epoch_ms(np.round(edges[:-1]))
+        frame['end'] = from_epoch_ms(np.round(edges[1:]))
+    else:
+        raise ValueError(f'{path} has neither ts columns nor a Timestamp header')
+    frame['time'] = frame['start']
+    return frame
+
+def utilization_frame(path: str, tz: str = 'UTC') -> pd.DataFrame:
+    frame = pd.read_csv(path, header=0)
+    frame['time'] = from_naive_iso(frame['time'], tz)
+    return frame
+
+def jobs_frame(path: str, tz: str = 'UTC') -> pd.DataFrame:
+    # part4.py's jobs.csv: job, start and end time per finished job
+    frame = pd.read_csv(path, names=['job', 'start_time', 'end_time'], header=None)
+    frame['start'] = from_naive_iso(frame['start_time'], tz)
+    frame['end'] = from_naive_iso(frame['end_time'], tz)
+    return frame
+
+def pods_frame(path: str) -> pd.DataFrame:
+    # kubectl get pods -o json of a part 3 run, one row per terminated container
+    with open(path, 'r', encoding='utf-8') as file:
+        pods = json.load(file)
+    rows: List[Dict[str, str]] = []
+    for item in pods['items']:
+        for status in item['status'].get('containerStatuses', []):
+            terminated = status.get('state', {}).get('terminated')
+            if terminated is not None:
+                rows.append({'job': status['name'], 'start_time': terminated['startedAt'],
+                             'end_time': terminated['finishedAt']})
+    frame = pd.DataFrame(rows, columns=['job', 'start_time', 'end_time'])
+    frame['start'] = from_rfc3339(frame['start_time'])
+    frame['end'] = from_rfc3339(frame['end_time'])
+    return frame
+
+def asof(grid: np.ndarray, frame: pd.DataFrame, columns: Optional[List[str]] = None,
+         tolerance: Optional[int] = None, on: str = 'time') -> pd.DataFrame:
+    # Latest row of frame at or before each grid time (NaN before its first
+    # row or when older than tolerance ns), found by binary search
+    frame = frame.sort_values(on, kind='stable')
+    times = frame[on].to_numpy()
+    rows = np.searchsorted(times, grid, side='right') - 1
+    valid = rows >= 0
+    if tolerance is not None:
+        valid &= grid - times[np.maximum(rows, 0)] <= tolerance
+    columns = columns if columns is not None else [column for column in frame.columns if column != on]
+    result = frame[columns].iloc[np.maximum(rows, 0)].reset_index(drop=True)
+    if not valid.all():
+        result = result.mask(np.broadcast_to(~valid[:, None], result.shape))
+    return result
+
+def resample(frames: Dict[str, pd.DataFrame], step_ns: int, start: Optional[int] = None,
+             end: Optional[int] = None, tolerance: Optional[int] = None) -> pd.DataFrame:
+    # Every frame as-of joined onto one grid of step_ns spanning all of them
+    # (or [start, end]); columns are prefixed with the frame's name
+    start = start if start is not None else min(int(frame['time'].min()) for frame in frames.values())
+    end = end if end is not None else max(int(frame['time'].max()) for frame in frames.values())
+    grid = np.arange(start, end + 1, step_ns, dtype=np.int64)
+    joined = pd.DataFrame({'time': grid})
+    for name, frame in frames.items():
+        sampled = asof(grid, frame, tolerance=tolerance)
+        joined = pd.concat([joined, sampled.add_prefix(f'{name}_')], axis=1)
+    return joined
+
+def relative_seconds(times, origin: int) -> np.ndarray:
+    return (np.asarray(times, dtype=np.int64) - origin) / 1e9